@@ -3,25 +3,41 @@ Agent implementation
 Provides a simple agent loop with tool support using LiteLLM.
 """
 
+import asyncio
 import json
 import logging
-import traceback
-from typing import Any, Dict, Generator, List, Optional
+import re
+import time
+from typing import Any, AsyncGenerator, Dict, List, NamedTuple, Optional, Tuple
+
+import litellm
+from pydantic import TypeAdapter, ValidationError
 
 # Import Chat class
 from vmpilot.chat import Chat
-from vmpilot.config import MAX_TOKENS, TEMPERATURE, TOOL_OUTPUT_LINES
+from vmpilot.config import (
+    FOLLOWUP_MAX_TOKENS,
+    HISTORY_TOKEN_BUDGET,
+    MAX_TOKENS,
+    RESPONSE_CACHE,
+    STREAM_RESPONSES,
+    TEMPERATURE,
+    TOOL_OUTPUT_LINES,
+    TOOL_RESULT_SUMMARY_MODEL,
+)
 from vmpilot.config import Provider as APIProvider
 from vmpilot.config import config, current_provider, prompt_suffix
 from vmpilot.exchange import Exchange
 from vmpilot.init_agent import create_agent, modify_state_messages
 from vmpilot.tools.setup_tools import get_tool_schemas, setup_tools
+from vmpilot.tools.shelltool import invalidate_shell_cache, is_cacheable_command
 from vmpilot.unified_memory import (
     clear_conversation_state,
     get_conversation_state,
     save_conversation_state,
 )
 from vmpilot.usage import Usage
+from vmpilot.utils import json_dumps
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -30,57 +46,335 @@ logger = logging.getLogger(__name__)
 logging.getLogger("LiteLLM").setLevel(logging.WARNING)
 logging.getLogger("litellm").setLevel(logging.WARNING)
 logging.getLogger("httpx").setLevel(logging.WARNING)
+# Don't print LiteLLM's "Give Feedback / Get Help" banner on every failed
+# request, the error itself is logged and shown to the user
+litellm.suppress_debug_info = True
+
+# Tool call arguments must be a JSON object. Pydantic parses and validates the
+# JSON string in one pass in its compiled core.
+_TOOL_ARGUMENTS_ADAPTER = TypeAdapter(Dict[str, Any])
+# A JSON object embedded in other text, for repairing malformed arguments
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+
+# A cached response is only a valid answer when sampling is deterministic, and
+# a streamed response is consumed chunk by chunk rather than cached whole
+_USE_RESPONSE_CACHE = RESPONSE_CACHE and TEMPERATURE == 0 and not STREAM_RESPONSES
+
+if _USE_RESPONSE_CACHE:
+    from litellm.caching.caching import Cache, CacheMode
+
+    # In-memory cache, opt-in per request: only the agent loop asks for it
+    litellm.cache = Cache(type="local", mode=CacheMode.default_off)
+elif RESPONSE_CACHE:
+    logger.warning(
+        "response_cache is ignored: it only applies with temperature 0 and "
+        "stream = false, not temperature %s and stream = %s",
+        TEMPERATURE,
+        str(STREAM_RESPONSES).lower(),
+    )
+
+
+# Maximum number of tool calls from one assistant turn that run at the same time
+MAX_PARALLEL_TOOLS = 4
+# Tools that only read state, so their calls can run alongside each other.
+# Shell commands count when is_cacheable_command accepts them.
+_READ_ONLY_TOOLS = {"web_search"}
+
+# Longest tool result kept in the history. Every later request resends the
+# history, so a huge command output (build logs, a large file) is capped by
+# keeping its start and end.
+MAX_TOOL_RESULT_CHARS = 65536
+
+# Streamed text is passed on in pieces of at least this many characters, or
+# whatever has arrived once this many seconds have passed since the last piece.
+# Providers send a few characters per chunk, and every piece crosses the thread
+# queue and is rendered separately by the UI.
+_STREAM_FLUSH_CHARS = 64
+_STREAM_FLUSH_SECONDS = 0.016
+
+# Tool results longer than this are condensed by TOOL_RESULT_SUMMARY_MODEL, when
+# set. Only the start of a result is sent to it, and its answer is kept short.
+_TOOL_RESULT_SUMMARY_THRESHOLD = 4096
+_TOOL_RESULT_SUMMARY_INPUT_CHARS = 30000
+_TOOL_RESULT_SUMMARY_MAX_TOKENS = 400
+
+# Tools that change files, which makes cached shell output stale
+_FILE_WRITING_TOOLS = frozenset({"create_file", "edit_file"})
 
+# Header shown in the UI before the output of a shell command
+_SHELL_COMMAND_HEADER = "\n\n**$ {}**\n".format
 
-def parse_tool_calls(response) -> tuple:
+
+class ParsedResponse(NamedTuple):
+    """Tool calls, text content and finish reason extracted from an LLM response."""
+
+    tool_calls: List[Dict[str, Any]]
+    content: Optional[str]
+    finish_reason: Optional[str]
+    history_tool_calls: List[Dict[str, Any]]
+
+
+def _parse_tool_arguments(raw_arguments: str) -> Dict[str, Any]:
+    """
+    Parse the JSON arguments of a tool call into a dict.
+
+    Well-formed arguments are parsed directly. Some providers send arguments
+    that are almost right, so before giving up this also accepts:
+    - empty arguments, for a tool without parameters
+    - an empty object glued in front of the real one ("{}{...}"), from a
+      first stream delta that carried "{}"
+    - an object encoded a second time as a JSON string
+    - an object missing its closing braces
+    - an object surrounded by other text
+
+    Raises:
+        ValueError: If the arguments can't be read as a JSON object
+    """
+    if not raw_arguments.strip():
+        return {}
+    try:
+        return _TOOL_ARGUMENTS_ADAPTER.validate_json(raw_arguments)
+    except ValidationError:
+        pass
+
+    candidates = [raw_arguments]
+    if raw_arguments.startswith("{}"):
+        candidates.append(raw_arguments[2:])
+    candidates.extend(raw_arguments + "}" * n for n in range(1, 6))
+    match = _JSON_OBJECT_RE.search(raw_arguments)
+    if match:
+        candidates.append(match.group())
+
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+            # Unwrap an object that was encoded as a JSON string
+            while isinstance(value, str):
+                value = json.loads(value)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            # The arguments can be a whole file body, so only log the start
+            logger.warning(
+                "Repaired malformed tool call arguments (%d chars): %.200s",
+                len(raw_arguments),
+                raw_arguments,
+            )
+            return value
+    raise ValueError(
+        f"Tool call arguments are not a JSON object ({len(raw_arguments)} chars): "
+        f"{raw_arguments[:200]}"
+    )
+
+
+def parse_tool_calls(response) -> ParsedResponse:
     """
     Extract tool calls and content from the LLM response.
 
     Returns:
-        tuple: (tool_calls, content) where content is the text message if present
+        ParsedResponse: (tool_calls, content, finish_reason, history_tool_calls)
+        where content is the text message if present, finish_reason says why
+        the model stopped, and history_tool_calls are the same tool calls in the
+        OpenAI format for the assistant message in the history, with the
+        arguments kept as the JSON string the model sent
     """
     tool_calls = []
     content = None
+    finish_reason = None
+    history_tool_calls = []
 
     try:
         # Extract tool calls from the response
-        if hasattr(response, "choices") and len(response.choices) > 0:
-            message = response.choices[0].message
-        else:
-            return tool_calls, content
+        choices = getattr(response, "choices", None)
+        if not choices:
+            return ParsedResponse(
+                tool_calls, content, finish_reason, history_tool_calls
+            )
+        finish_reason = getattr(choices[0], "finish_reason", None)
+        message = choices[0].message
 
         # Get content if available
-        if hasattr(message, "content") and message.content:
-            content = message.content
-
-        if hasattr(message, "tool_calls") and message.tool_calls:
-            for tool_call in message.tool_calls:
-                # Parse arguments from JSON string to dict
-                try:
-                    arguments = json.loads(tool_call.function.arguments)
-                except json.JSONDecodeError:
-                    arguments = {"error": "Failed to parse arguments"}
-
-                tool_calls.append(
-                    {
-                        "id": tool_call.id,
-                        "name": tool_call.function.name,
-                        "arguments": arguments,
-                    }
+        content = getattr(message, "content", None) or None
+
+        for tool_call in getattr(message, "tool_calls", None) or ():
+            raw_arguments = tool_call.function.arguments
+            if not isinstance(raw_arguments, str):
+                logger.warning(
+                    f"Tool call function arguments were not a string: {type(raw_arguments)}. Converting to JSON string."
                 )
+                raw_arguments = json_dumps(raw_arguments)
+
+            # Parse arguments from JSON string to dict
+            try:
+                arguments = _parse_tool_arguments(raw_arguments)
+            except ValueError:
+                arguments = {"error": "Failed to parse arguments"}
+
+            tool_calls.append(
+                {
+                    "id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "arguments": arguments,
+                }
+            )
+            history_tool_calls.append(
+                {
+                    "id": tool_call.id,
+                    "type": tool_call.type or "function",
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": raw_arguments,
+                    },
+                }
+            )
     except Exception as e:
         logger.error(f"Error parsing tool calls: {str(e)}")
 
-    return tool_calls, content
+    return ParsedResponse(tool_calls, content, finish_reason, history_tool_calls)
 
 
-import asyncio
+class _UsageMessage:
+    """
+    Adapt LiteLLM response usage to the message format the Usage class expects.
+
+    LiteLLM response structure is different, so the token counts are copied
+    into usage_metadata and response_metadata.
+    """
+
+    def __init__(self, usage_data, model_name):
+        self.usage_metadata = {
+            "input_tokens": usage_data.prompt_tokens,
+            "output_tokens": usage_data.completion_tokens,
+            "cache_creation_input_tokens": getattr(
+                usage_data, "cache_creation_input_tokens", 0
+            ),
+        }
+        # Handle completion_tokens_details if present
+        if hasattr(usage_data, "completion_tokens_details"):
+            details = usage_data.completion_tokens_details
+            if hasattr(details, "reasoning_tokens"):
+                self.usage_metadata["reasoning_tokens"] = details.reasoning_tokens
+
+        # Handle prompt_tokens_details if present (for cached tokens)
+        if hasattr(usage_data, "prompt_tokens_details"):
+            details = usage_data.prompt_tokens_details
+            if hasattr(details, "cached_tokens"):
+                self.usage_metadata["input_token_details"] = {
+                    "cache_read": details.cached_tokens
+                }
+
+        self.response_metadata = {
+            "model_name": model_name,
+            "token_usage": {
+                "prompt_tokens": usage_data.prompt_tokens,
+                "completion_tokens": usage_data.completion_tokens,
+                "total_tokens": usage_data.total_tokens,
+                "cache_creation_input_tokens": getattr(
+                    usage_data, "cache_creation_input_tokens", 0
+                ),
+            },
+        }
+        # Add prompt_tokens_details if available
+        if hasattr(usage_data, "prompt_tokens_details"):
+            self.response_metadata["token_usage"]["prompt_tokens_details"] = {
+                "cached_tokens": getattr(
+                    usage_data.prompt_tokens_details, "cached_tokens", 0
+                )
+            }
+
+
+def _log_prompt_cache_hits(usage_data, iteration: int) -> None:
+    """
+    Log how much of the prompt was served from the provider's prompt cache.
+
+    LiteLLM reports cache reads as prompt_tokens_details.cached_tokens for
+    both OpenAI and Anthropic, and prompt_tokens includes them.
+    """
+    prompt_tokens = getattr(usage_data, "prompt_tokens", 0) or 0
+    details = getattr(usage_data, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    if prompt_tokens:
+        logger.debug(
+            "Prompt cache, iteration %d: %d of %d prompt tokens cached (%.0f%%)",
+            iteration,
+            cached_tokens,
+            prompt_tokens,
+            100 * cached_tokens / prompt_tokens,
+        )
+
+
+def _message_tokens(
+    msg: Dict[str, Any], model: str, token_counts: Dict[int, Tuple[Dict, int]]
+) -> int:
+    """Count the tokens of one message, reusing the count from token_counts."""
+    cached = token_counts.get(id(msg))
+    # The message is stored along with its count, so a reused id can't match
+    if cached is not None and cached[0] is msg:
+        return cached[1]
+    count = litellm.token_counter(model=model, messages=[msg])
+    token_counts[id(msg)] = (msg, count)
+    return count
+
+
+def _truncate_history(
+    messages: List[Dict[str, Any]],
+    model: str,
+    max_tokens: int,
+    token_counts: Optional[Dict[int, Tuple[Dict, int]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Drop the oldest exchanges from the history until it fits in max_tokens.
+
+    An exchange starts at a user message and runs until the next one, so an
+    assistant tool call is always dropped together with its tool results.
+    System messages and the current exchange are always kept, even if they
+    alone exceed the budget.
+
+    Args:
+        messages: The conversation history
+        model: Model name, used to pick the tokenizer
+        max_tokens: Token budget for the history
+        token_counts: Token counts of messages seen before, filled in as
+            messages are counted. Passing the same dict on every call of an
+            agent loop counts each message only once.
+
+    Returns:
+        The history itself if it fits, otherwise a shorter copy
+    """
+    if token_counts is None:
+        token_counts = {}
+    system_messages = [msg for msg in messages if msg.get("role") == "system"]
+    exchanges: List[List[Dict[str, Any]]] = []
+    for msg in messages:
+        if msg.get("role") == "system":
+            continue
+        if msg.get("role") == "user" or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(msg)
+
+    counts = [
+        sum(_message_tokens(msg, model, token_counts) for msg in ex) for ex in exchanges
+    ]
+    total = sum(_message_tokens(msg, model, token_counts) for msg in system_messages)
+    total += sum(counts)
+    if total <= max_tokens:
+        return messages
+
+    dropped = 0
+    while dropped < len(exchanges) - 1 and total > max_tokens:
+        total -= counts[dropped]
+        dropped += 1
+    logger.info(
+        f"History over the {max_tokens} token budget, dropped {dropped} oldest exchanges"
+    )
+    return system_messages + [msg for ex in exchanges[dropped:] for msg in ex]
 
 
 def truncate_tool_output_for_ui(result):
     """
     Truncate tool output for UI display based on TOOL_OUTPUT_LINES config.
-    This replicates the logic from the old tool_callback function.
+    Used for tool results shown by the agent loop and by response.tool_callback.
     """
     outputs = []
     if isinstance(result, dict):
@@ -97,17 +391,280 @@ def truncate_tool_output_for_ui(result):
 
     truncated_outputs = []
     for output in outputs:
-        output_lines = str(output).splitlines()
-        truncated_output = "\n".join(output_lines[:TOOL_OUTPUT_LINES])
-        if len(output_lines) > (TOOL_OUTPUT_LINES + 1):
-            truncated_output += f"\n...\n````\n(and {len(output_lines) - TOOL_OUTPUT_LINES} more lines)\n"
+        output = str(output)
+        head, more = _head_lines(output, TOOL_OUTPUT_LINES)
+        if more > 1:
+            truncated_outputs.append(f"{head}\n...\n````\n(and {more} more lines)\n")
         else:
-            truncated_output += "\n"
-        truncated_outputs.append(truncated_output)
+            # Nothing, or a single line, is left: show the output in full
+            truncated_outputs.append(output if output.endswith("\n") else output + "\n")
 
     return "".join(truncated_outputs)
 
 
+def _head_lines(text: str, count: int) -> tuple:
+    """
+    Split off the first lines of a text without splitting the rest of it, which
+    can be megabytes of command output.
+
+    Returns:
+        tuple: (head, more) where head holds the first ``count`` lines without
+        a trailing newline, and more is the number of lines after them
+    """
+    end = -1
+    for _ in range(count):
+        end = text.find("\n", end + 1)
+        if end == -1:
+            return text, 0
+    rest_start = end + 1
+    if rest_start >= len(text):
+        return text[:end], 0
+    more = text.count("\n", rest_start) + (not text.endswith("\n"))
+    return text[: max(end, 0)], more
+
+
+def _cap_tool_result(result: str) -> str:
+    """Keep the head and tail of a tool result longer than MAX_TOOL_RESULT_CHARS."""
+    if len(result) <= MAX_TOOL_RESULT_CHARS:
+        return result
+    head = MAX_TOOL_RESULT_CHARS * 2 // 3
+    tail = MAX_TOOL_RESULT_CHARS - head
+    omitted = len(result) - head - tail
+    return (
+        result[:head]
+        + f"\n...[{omitted} characters truncated, use head, tail or grep to see them]...\n"
+        + result[-tail:]
+    )
+
+
+def _tool_name(tool: Dict[str, Any]) -> Optional[str]:
+    """Get the name a tool is called by from its schema."""
+    schema = tool.get("schema")
+    # LiteLLM tool schemas have a standard format: {"type": "function", "function": {...}}
+    if isinstance(schema, dict):
+        if schema.get("type") == "function" and isinstance(
+            schema.get("function"), dict
+        ):
+            # Extract function name from the nested structure
+            return schema["function"].get("name")
+        # Direct name extraction (old format)
+        return schema.get("name")
+    if schema is not None and hasattr(schema, "name"):
+        return schema.name
+    return None
+
+
+def _index_tools(tools: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Map tool names to their tool dictionaries; the first tool with a name wins."""
+    tools_by_name = {}
+    for tool in tools:
+        name = _tool_name(tool)
+        if name is not None:
+            tools_by_name.setdefault(name, tool)
+    return tools_by_name
+
+
+def _execute_tool_call(
+    tool_call: Dict[str, Any], tools_by_name: Dict[str, Dict[str, Any]]
+) -> tuple:
+    """
+    Find the tool requested by a tool call and run its executor.
+
+    Runs in a worker thread (via asyncio.to_thread): it only reads
+    ``tools_by_name`` and never touches the conversation history.
+
+    Args:
+        tool_call: Parsed tool call with ``name`` and ``arguments``
+        tools_by_name: Tool dictionaries with their schemas and executors, by name
+
+    Returns:
+        tuple: (tool_result_for_history, truncated_output) where the first is the
+        result for the LLM, capped at MAX_TOOL_RESULT_CHARS, and the second is
+        the output to show in the UI
+    """
+    tool_name = tool_call["name"]
+    tool_args = tool_call["arguments"]
+
+    logger.debug("Executing tool: %s", tool_name)
+
+    matched_tool = tools_by_name.get(tool_name)
+
+    if matched_tool is not None:
+        try:
+            # Ensure the executor exists
+            if "executor" not in matched_tool:
+                error_msg = (
+                    f"Error: Tool '{tool_name}' found but has no executor function"
+                )
+                logger.error(error_msg)
+                return error_msg, truncate_tool_output_for_ui(error_msg)
+
+            tool_output = matched_tool["executor"](tool_args)
+            if tool_name in _FILE_WRITING_TOOLS:
+                invalidate_shell_cache()
+            # Store the output for LLM/history, capped since it's resent every turn
+            tool_result_for_history = _cap_tool_result(
+                tool_output if isinstance(tool_output, str) else str(tool_output)
+            )
+            # Truncated output for UI
+            return tool_result_for_history, truncate_tool_output_for_ui(tool_output)
+        except Exception as e:
+            error_msg = f"Error executing {tool_name} tool: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            return error_msg, truncate_tool_output_for_ui(error_msg) + "\n"
+
+    available_tools = list(tools_by_name)
+    error_msg = f"Error: Tool '{tool_name}' not found. Available tools: {', '.join(available_tools) if available_tools else 'None'}"
+    logger.error(error_msg)
+    return error_msg, truncate_tool_output_for_ui(error_msg) + "\n"
+
+
+def _latest_user_text(messages: List[Dict[str, Any]]) -> str:
+    """Get the text of the latest user message, which may be a list of content blocks."""
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return " ".join(
+                    block.get("text", "")
+                    for block in content
+                    if isinstance(block, dict)
+                )
+            return content or ""
+    return ""
+
+
+async def _summarize_tool_result(
+    result: str, task: str, api_key: Optional[str] = None
+) -> str:
+    """
+    Condense a large tool result to the parts needed for the task.
+
+    The result would otherwise be resent with every later request. The
+    summary is only used for the history: the UI shows the output itself.
+    If the summary request fails, the result is kept as it is.
+
+    Args:
+        result: The tool result
+        task: What the user asked for, to decide what to keep
+        api_key: API key of the main completion requests, which may come from
+            the configured key file rather than the environment
+    """
+    prompt = (
+        "Extract what is needed to continue this task from the tool output below.\n"
+        f"Task: {task}\n\n"
+        "Quote error messages, file paths and numbers exactly. "
+        "Say if the output doesn't contain what is needed.\n\n"
+        f"Tool output:\n{result[:_TOOL_RESULT_SUMMARY_INPUT_CHARS]}"
+    )
+    try:
+        response = await litellm.acompletion(
+            model=TOOL_RESULT_SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=_TOOL_RESULT_SUMMARY_MAX_TOKENS,
+            api_key=api_key,
+        )
+        summary = response.choices[0].message.content
+    except Exception as e:
+        logger.warning(f"Could not summarize tool result, keeping it whole: {e}")
+        return result
+    if not summary:
+        return result
+    return f"[Summary of {len(result)} characters of tool output]\n{summary}"
+
+
+def _is_read_only_tool_call(tool_call: Dict[str, Any]) -> bool:
+    """Check if a tool call only reads state, so it may overlap other reads."""
+    tool_name = tool_call["name"]
+    if tool_name == "shell_tool" or tool_name == "shell":
+        return is_cacheable_command(tool_call["arguments"].get("command") or "")
+    return tool_name in _READ_ONLY_TOOLS
+
+
+async def _run_tool_call_limited(
+    tool_call: Dict[str, Any],
+    tools_by_name: Dict[str, Dict[str, Any]],
+    semaphore,
+    after: List[Any],
+) -> tuple:
+    """
+    Run _execute_tool_call in a worker thread once the tool calls in after
+    have finished and the semaphore allows it.
+    """
+    if after:
+        await asyncio.wait(after)
+    async with semaphore:
+        return await asyncio.to_thread(_execute_tool_call, tool_call, tools_by_name)
+
+
+def _schedule_tool_call(
+    tool_call: Dict[str, Any],
+    tools_by_name: Dict[str, Dict[str, Any]],
+    semaphore,
+    scheduled: Dict[str, List[Any]],
+) -> Any:
+    """
+    Start a tool call as a task, ordered against the calls scheduled before it.
+
+    Read-only calls only wait for the last other call, so consecutive reads
+    run alongside each other. Any other call (e.g. an edit, or a shell command
+    that runs the edited code) waits for every call before it, and the calls
+    after it wait for it. scheduled holds that state for one assistant turn.
+    """
+    if _is_read_only_tool_call(tool_call):
+        task = asyncio.ensure_future(
+            _run_tool_call_limited(
+                tool_call, tools_by_name, semaphore, scheduled["writer"]
+            )
+        )
+        scheduled["readers"].append(task)
+    else:
+        task = asyncio.ensure_future(
+            _run_tool_call_limited(
+                tool_call,
+                tools_by_name,
+                semaphore,
+                scheduled["writer"] + scheduled["readers"],
+            )
+        )
+        scheduled["writer"] = [task]
+        scheduled["readers"] = []
+    return task
+
+
+def _start_streamed_tool_call(
+    streamed_call: Dict[str, Any],
+    tools_by_name: Dict[str, Dict[str, Any]],
+    semaphore,
+    scheduled: Dict[str, List[Any]],
+    started_tool_tasks: Dict[str, Any],
+) -> bool:
+    """
+    Start a tool call whose arguments have finished streaming, while the rest
+    of the response is still arriving. Calls that can't be parsed are left to
+    the normal path, which reports the error.
+
+    Returns:
+        bool: Whether the call was started
+    """
+    if not streamed_call["id"] or not streamed_call["name"]:
+        return False
+    try:
+        arguments = _parse_tool_arguments("".join(streamed_call["arguments"]))
+    except ValueError:
+        return False
+    tool_call = {
+        "id": streamed_call["id"],
+        "name": streamed_call["name"],
+        "arguments": arguments,
+    }
+    logger.debug("Starting tool call %s while streaming", tool_call["id"])
+    started_tool_tasks[tool_call["id"]] = _schedule_tool_call(
+        tool_call, tools_by_name, semaphore, scheduled
+    )
+    return True
+
+
 async def process_messages(
     model,
     provider,
@@ -173,7 +730,10 @@ async def process_messages(
     # This is a simplified version for lllm, focusing on message formatting for now
     # Full chat persistence, project checks etc. are not yet integrated here.
     try:
-        chat = Chat(
+        # A new chat checks the project structure and writes the chat record to
+        # the database, so build it in a worker thread to keep the loop free
+        chat = await asyncio.to_thread(
+            Chat,
             messages=messages,  # Original messages list
             output_callback=output_callback,  # Pass for potential chat_id announcement
             system_prompt_suffix=system_prompt_suffix,  # Pass for potential project dir extraction
@@ -242,17 +802,14 @@ async def process_messages(
             {"role": "user", "content": user_input},
         ]
     cache_info = previous_cache_info or {}
-    logger.debug(f"Messages for agent loop: {messages}")
+    logger.debug("Messages for agent loop: %s", messages)
 
     # The lllm agent_loop expects a list of messages in OpenAI format.
     # Call agent_loop and stream outputs through the correct callback
     try:
         # agent_loop now uses MAX_TOKENS, TEMPERATURE, and current_provider.api_key from config
-        for item in agent_loop(
-            user_input=user_input,  # Still needed for the first turn in agent_loop's internal history
-            messages=messages,  # Pass original messages for context if needed by agent_loop
-            chat_object=chat,  # Pass the chat object for potential future use or context
-            system_prompt=system_prompt,  # Now using the dynamically constructed prompt
+        async for item in agent_loop(
+            messages=messages,  # History ending with the new user message
             tools=tools,
             model=model,  # model is passed correctly
             exchange=exchange,  # Pass exchange for tracking
@@ -267,7 +824,6 @@ async def process_messages(
             else:
                 if output_callback:
                     output_callback({"type": "text", "text": item})
-            await asyncio.sleep(0)  # Yield control to event loop for streaming
 
         # After agent loop completes, handle usage tracking and cost display
         if usage:
@@ -302,385 +858,325 @@ async def process_messages(
         logger.debug(f"Saved conversation state for chat_id: {chat.chat_id}")
 
 
-def agent_loop(
-    user_input: str,
-    system_prompt: str,
+async def agent_loop(
     tools: List[Dict[str, Any]],
     model: str = "gpt-4o",
-    messages: Optional[List[Dict[str, Any]]] = None,  # Added
-    chat_object: Optional[Any] = Chat,
+    messages: Optional[List[Dict[str, Any]]] = None,
     exchange: Optional[Exchange] = None,
     usage: Optional[Usage] = None,
     agent_config: Optional[Dict[str, Any]] = None,
     recursion_limit: Optional[int] = None,
-) -> Generator[str, None, None]:
+) -> AsyncGenerator[str, None]:
     """
     Simple agent loop that processes user input, sends it to the LLM,
     executes tools when requested, and yields responses and tool outputs as they are generated.
+
+    The system prompt and the user input are part of ``messages``, which is
+    extended in place with the assistant and tool messages of this exchange.
     """
     messages = messages or []
 
-    # API key, provider, max_tokens, and temperature are now sourced from config.py
-    # (current_provider.api_key, current_provider.name, MAX_TOKENS, TEMPERATURE)
-    # The 'model' variable is passed as an argument to this function.
-    # The 'api_key' for litellm.completion will use current_provider.api_key.
-
     # Main agent loop
     max_iterations = recursion_limit or 20  # Use recursion_limit or default to 20
     iteration = 0
     all_tool_calls = []  # Track all tool calls for exchange completion
 
+    # Everything except the message history is the same for every iteration,
+    # so resolve the model, tools, key and provider-specific parameters once.
+    # Use model from agent_config if available (includes proper prefixes like gemini/)
+    # otherwise fall back to the model parameter
+    effective_model = (agent_config.get("model") if agent_config else None) or model
+
+    # Extract just the schema part for LiteLLM
+    tool_schemas = get_tool_schemas(tools, effective_model)
+    # Tool calls are dispatched by name, so index the tools once per request
+    tools_by_name = _index_tools(tools)
+    logger.debug("Using tools: %s", list(tools_by_name))
+    logger.debug("Using effective model: %s", effective_model)
+
+    base_completion_params = {
+        "model": effective_model,
+        "tools": tool_schemas,  # Pass only the schemas
+        "temperature": TEMPERATURE,  # This is a float, not a ContextVar
+        "api_key": (
+            agent_config.get("api_key")
+            if agent_config
+            else config.get_api_key(current_provider.get())
+        ),  # Use agent_config api_key if available, otherwise fallback
+        "max_tokens": MAX_TOKENS,  # This is an int, not a ContextVar
+        # Stream the response so text reaches the user as it is generated
+        "stream": STREAM_RESPONSES,
+    }
+    # Requests after the first one mostly answer tool results, and can be
+    # given a lower output limit to bound their latency
+    followup_max_tokens = (
+        min(FOLLOWUP_MAX_TOKENS, MAX_TOKENS) if FOLLOWUP_MAX_TOKENS else None
+    )
+    if _USE_RESPONSE_CACHE:
+        # Serve identical requests from the local LiteLLM cache
+        base_completion_params["cache"] = {"use-cache": True}
+
+    # Add provider-specific parameters from agent_config
+    anthropic_system_content = None
+    if agent_config and agent_config.get("provider") == APIProvider.ANTHROPIC:
+        if "anthropic_system_content" in agent_config:
+            anthropic_system_content = agent_config["anthropic_system_content"]
+            base_completion_params["system"] = anthropic_system_content
+
+        if "anthropic_extra_headers" in agent_config:
+            base_completion_params["extra_headers"] = agent_config[
+                "anthropic_extra_headers"
+            ]
+        # No separate cache breakpoint for the tools: Anthropic caches the prefix
+        # in the order tools, system, messages, so the system breakpoint already
+        # covers the tool schemas, and the last 3 messages use the other slots.
+    elif (
+        agent_config
+        and agent_config.get("provider") == APIProvider.OPENAI
+        and exchange
+        and exchange.chat_id
+    ):
+        # OpenAI caches prompt prefixes automatically. A stable per-chat key routes
+        # every request of this conversation to the same cache, which keeps the
+        # system prompt, tools and earlier turns hitting it on later iterations.
+        # Sent via extra_body so it works regardless of the installed SDK version.
+        base_completion_params["extra_body"] = {
+            "prompt_cache_key": str(exchange.chat_id)
+        }
+    if (
+        STREAM_RESPONSES
+        and agent_config
+        and agent_config.get("provider") == APIProvider.OPENAI
+    ):
+        # OpenAI only reports usage for a stream when asked to, in a final chunk.
+        # The other providers include it without this option and reject it.
+        base_completion_params["stream_options"] = {"include_usage": True}
+
+    # Token counts of the history's messages, kept across iterations
+    history_token_counts: Dict[int, Tuple[Dict, int]] = {}
+
     while iteration < max_iterations:
         iteration += 1
-        logger.debug(f"Agent loop iteration {iteration}")
+        logger.debug("Agent loop iteration %d", iteration)
 
+        # Tool calls started before the response finished streaming, by id
+        started_tool_tasks = {}
+        tool_tasks = []
         try:
-            # Apply modify_state_messages for cache control (Anthropic)
-            modified_messages = modify_state_messages(messages.copy())
-            logger.debug(
-                f"Modified messages for iteration {iteration}: {modified_messages}"
-            )
-
-            # Call LLM via LiteLLM
-            # Extract just the schema part for LiteLLM
-            # Use model from agent_config if available (includes proper prefixes like gemini/)
-            # otherwise fall back to the model parameter
-            effective_model = (
-                agent_config.get("model") if agent_config else None
-            ) or model
+            history = messages
+            if HISTORY_TOKEN_BUDGET:
+                # Every iteration resends the whole history, so keep it bounded
+                history = _truncate_history(
+                    messages,
+                    effective_model,
+                    HISTORY_TOKEN_BUDGET,
+                    history_token_counts,
+                )
 
-            tool_schemas = get_tool_schemas(tools, effective_model)
-            # Debug logging
+            # Apply modify_state_messages for cache control (Anthropic), which
+            # returns a new list and leaves the history itself unchanged
+            modified_messages = modify_state_messages(history)
+            # Lazy formatting: repr-ing the whole, growing history on every
+            # iteration is only worth it when debug logging is actually on.
             logger.debug(
-                f"Using tools: {[t.get('schema', {}).get('function', {}).get('name') for t in tools]}"
+                "Modified messages for iteration %d: %s", iteration, modified_messages
             )
-            logger.debug(f"Using effective model: {effective_model}")
-
-            # Prepare completion parameters
-            completion_params = {
-                "model": effective_model,
-                "messages": modified_messages,
-                "tools": tool_schemas,  # Pass only the schemas
-                "temperature": TEMPERATURE,  # This is a float, not a ContextVar
-                "api_key": (
-                    agent_config.get("api_key")
-                    if agent_config
-                    else config.get_api_key(current_provider.get())
-                ),  # Use agent_config api_key if available, otherwise fallback
-                "max_tokens": MAX_TOKENS,  # This is an int, not a ContextVar
-            }
 
-            # Add provider-specific parameters from agent_config
-            if agent_config:
-                provider = agent_config.get("provider")
-                if provider == APIProvider.ANTHROPIC:
-                    # Handle Anthropic-specific parameters
-                    if "anthropic_system_content" in agent_config:
-                        # For Anthropic, replace system message with structured content
-                        anthropic_messages = []
-                        for msg in modified_messages:
-                            if msg.get("role") == "system":
-                                continue  # Skip system messages in messages array
-                            anthropic_messages.append(msg)
-                        completion_params["messages"] = anthropic_messages
-                        completion_params["system"] = agent_config[
-                            "anthropic_system_content"
-                        ]
-
-                    if "anthropic_extra_headers" in agent_config:
-                        completion_params["extra_headers"] = agent_config[
-                            "anthropic_extra_headers"
-                        ]
-
-            import litellm
-
-            response = litellm.completion(**completion_params)
-
-            # Track usage from the response if usage tracking is enabled
-            if usage:
-                # LiteLLM response structure is different - need to convert to expected format
-                usage_data = getattr(response, "usage", None)
-                if usage_data is not None:
-                    # Create a mock message object with usage metadata for the Usage class
-                    class MockMessage:
-                        def __init__(self, usage_data, model_name):
-                            self.usage_metadata = {
-                                "input_tokens": usage_data.prompt_tokens,
-                                "output_tokens": usage_data.completion_tokens,
-                                "cache_creation_input_tokens": getattr(
-                                    usage_data, "cache_creation_input_tokens", 0
-                                ),
-                            }
-                            # Handle completion_tokens_details if present
-                            if hasattr(usage_data, "completion_tokens_details"):
-                                details = usage_data.completion_tokens_details
-                                if hasattr(details, "reasoning_tokens"):
-                                    self.usage_metadata["reasoning_tokens"] = (
-                                        details.reasoning_tokens
-                                    )
-
-                            # Handle prompt_tokens_details if present (for cached tokens)
-                            if hasattr(usage_data, "prompt_tokens_details"):
-                                details = usage_data.prompt_tokens_details
-                                if hasattr(details, "cached_tokens"):
-                                    self.usage_metadata["input_token_details"] = {
-                                        "cache_read": details.cached_tokens
-                                    }
-
-                            self.response_metadata = {
-                                "model_name": model_name,
-                                "token_usage": {
-                                    "prompt_tokens": usage_data.prompt_tokens,
-                                    "completion_tokens": usage_data.completion_tokens,
-                                    "total_tokens": usage_data.total_tokens,
-                                    "cache_creation_input_tokens": getattr(
-                                        usage_data, "cache_creation_input_tokens", 0
-                                    ),
-                                },
-                            }
-                            # Add prompt_tokens_details if available
-                            if hasattr(usage_data, "prompt_tokens_details"):
-                                self.response_metadata["token_usage"][
-                                    "prompt_tokens_details"
-                                ] = {
-                                    "cached_tokens": getattr(
-                                        usage_data.prompt_tokens_details,
-                                        "cached_tokens",
-                                        0,
-                                    )
-                                }
-
-                    # Patch: .usage may not exist on all response types
-                    usage_data = getattr(response, "usage", None)
-                    if usage_data is not None:
-                        mock_message = MockMessage(usage_data, model)
-                        usage.add_tokens(mock_message)
-                    else:
-                        # Some streaming wrappers (CustomStreamWrapper) may keep usage as an attribute in .__dict__
+            # Prepare completion parameters for this iteration
+            completion_params = dict(base_completion_params)
+            if followup_max_tokens and iteration > 1:
+                completion_params["max_tokens"] = followup_max_tokens
+            if anthropic_system_content is not None:
+                # For Anthropic, replace system message with structured content
+                completion_params["messages"] = [
+                    msg for msg in modified_messages if msg.get("role") != "system"
+                ]
+            else:
+                completion_params["messages"] = modified_messages
+
+            # Bound how many tool calls run at once so a large batch of commands
+            # doesn't flood the machine with processes
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_TOOLS)
+            # Tasks of the last non-read-only tool call and the reads after it
+            scheduled_tools = {"writer": [], "readers": []}
+
+            # Await the completion so the event loop stays free during the request,
+            # and pass text on as soon as each piece of it arrives
+            response = await litellm.acompletion(**completion_params)
+            if _USE_RESPONSE_CACHE and (
+                getattr(response, "_hidden_params", None) or {}
+            ).get("cache_hit"):
+                logger.debug("Iteration %d: response served from the cache", iteration)
+            if STREAM_RESPONSES:
+                chunks = []
+                pending = []
+                pending_chars = 0
+                last_flush = time.monotonic()
+                # The tool call whose arguments are currently streaming
+                streamed_call = None
+                # Calls are only started early while all the ones before them
+                # were, so they are scheduled in the order they were issued
+                start_streamed_calls = True
+                async for chunk in response:
+                    chunks.append(chunk)
+                    # The usage chunk at the end of an OpenAI stream has no choices
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    for call_delta in delta.tool_calls or ():
                         if (
-                            hasattr(response, "__dict__")
-                            and "usage" in response.__dict__
+                            streamed_call is not None
+                            and call_delta.index != streamed_call["index"]
                         ):
-                            mock_message = MockMessage(
-                                response.__dict__["usage"], model
+                            # The model moved on to the next tool call, so this
+                            # one is complete: run it while the rest streams
+                            start_streamed_calls = (
+                                start_streamed_calls
+                                and _start_streamed_tool_call(
+                                    streamed_call,
+                                    tools_by_name,
+                                    semaphore,
+                                    scheduled_tools,
+                                    started_tool_tasks,
+                                )
                             )
-                            usage.add_tokens(mock_message)
+                            streamed_call = None
+                        if streamed_call is None:
+                            streamed_call = {
+                                "index": call_delta.index,
+                                "id": None,
+                                "name": None,
+                                "arguments": [],
+                            }
+                        streamed_call["id"] = streamed_call["id"] or call_delta.id
+                        function = call_delta.function
+                        if function is not None:
+                            streamed_call["name"] = (
+                                streamed_call["name"] or function.name
+                            )
+                            if function.arguments:
+                                streamed_call["arguments"].append(function.arguments)
+                    if delta.content:
+                        text = delta.content
+                        pending.append(text)
+                        pending_chars += len(text)
+                        now = time.monotonic()
+                        if (
+                            pending_chars >= _STREAM_FLUSH_CHARS
+                            or now - last_flush >= _STREAM_FLUSH_SECONDS
+                        ):
+                            yield "".join(pending)
+                            pending.clear()
+                            pending_chars = 0
+                            last_flush = now
+                # Pass on the rest before any tool output is shown
+                if pending:
+                    yield "".join(pending)
+
+                # Rebuild the complete response from the chunks: tool call ids,
+                # names and argument fragments are put back together, and usage
+                # is collected
+                response = litellm.stream_chunk_builder(
+                    chunks, messages=completion_params["messages"]
+                )
 
-            # Parse tool calls and content from response
-            tool_calls, content = parse_tool_calls(response)
+            # .usage may not exist on all response types
+            usage_data = getattr(response, "usage", None)
+            if usage_data is not None:
+                _log_prompt_cache_hits(usage_data, iteration)
+                # Track usage from the response if usage tracking is enabled
+                if usage:
+                    usage.add_tokens(_UsageMessage(usage_data, model))
 
-            # Yield LLM's textual response if present
-            if content:
+            # Parse tool calls and content from response
+            tool_calls, content, finish_reason, history_tool_calls = parse_tool_calls(
+                response
+            )
+            if content and not STREAM_RESPONSES:
+                # Streamed content was already passed on as it arrived
                 yield content
 
             # If no tool calls, we've reached the final response from the LLM for this turn
             if not tool_calls:
-                # Add the final assistant message to history before completing
-                choices = getattr(response, "choices", None)
-                if choices and len(choices) > 0:
-                    assistant_msg_obj = choices[0].message
-
-                    # Create the assistant message for history
-                    final_assistant_msg = {
-                        "role": "assistant",
-                        "content": (
-                            str(assistant_msg_obj.content)
-                            if assistant_msg_obj.content is not None
-                            else None
-                        ),
-                    }
-
-                    # Add to messages history
+                # Add the final assistant message to history before completing,
+                # built from the parsed content rather than by copying the
+                # LiteLLM message object
+                final_assistant_msg = {}
+                if getattr(response, "choices", None):
+                    final_assistant_msg = {"role": "assistant", "content": content}
                     messages.append(final_assistant_msg)
                     logger.debug(
-                        f"Added final assistant message to history: {final_assistant_msg}"
+                        "Added final assistant message to history: %s",
+                        final_assistant_msg,
                     )
 
                 # Complete the exchange with the final assistant message
                 if exchange:
-                    if choices and len(choices) > 0 and hasattr(choices[0], "message"):
-                        assistant_message = choices[0].message
-                        if hasattr(assistant_message, "__dict__"):
-                            exchange.complete(vars(assistant_message), [])
-                        else:
-                            exchange.complete({"content": str(assistant_message)}, [])
-                    else:
-                        exchange.complete({}, [])
-
-                # If there was no textual content, but the LLM didn't call a tool,
-                # it might be an empty response or an implicit end of operation.
-                # The original code had: final_response = content or response.choices[0].message.content
-                # If content was None, but there was a message, yield that.
-                # However, parse_tool_calls should already put message.content into `content`.
-                # If content is still None and no tools, it's likely the end.
-                if not content:
-                    if choices and len(choices) > 0 and hasattr(choices[0], "message"):
-                        message_content = getattr(choices[0].message, "content", None)
-                        if message_content:
-                            yield message_content
+                    exchange.complete(final_assistant_msg, [])
+
+                if finish_reason == "length":
+                    logger.warning(
+                        "LLM response was cut off by the max_tokens limit (finish_reason=length)"
+                    )
                 return  # End of this agent interaction or loop
 
             # Append the assistant's message with tool calls to history
-            choices = getattr(response, "choices", None)
-            if choices and len(choices) > 0:
-                assistant_msg_obj = choices[
-                    0
-                ].message  # This is a litellm.Message object
-            else:
-                continue  # Skip this iteration if no choices
-
-            history_assistant_msg = {
-                "role": assistant_msg_obj.role,
-                "content": (
-                    str(assistant_msg_obj.content)
-                    if assistant_msg_obj.content is not None
-                    else None
-                ),
-            }
-
-            if (
-                hasattr(assistant_msg_obj, "tool_calls")
-                and assistant_msg_obj.tool_calls
-            ):
-                clean_tool_calls_for_history = []
-                for tc_instance in assistant_msg_obj.tool_calls:
-                    # tc_instance is expected to be litellm.types.CompletionMessageToolCall
-                    # It should have .id, .type, .function (with .name, .arguments)
-                    try:
-                        # Ensure arguments is a string (JSON string)
-                        func_args = tc_instance.function.arguments
-                        if not isinstance(func_args, str):
-                            logger.warning(
-                                f"Tool call function arguments were not a string: {type(func_args)}. Converting to JSON string."
-                            )
-                            func_args = json.dumps(
-                                func_args
-                            )  # Should already be JSON string from LLM
-
-                        clean_tool_calls_for_history.append(
-                            {
-                                "id": tc_instance.id,
-                                "type": tc_instance.type,
-                                "function": {
-                                    "name": tc_instance.function.name,
-                                    "arguments": func_args,
-                                },
-                            }
-                        )
-                    except AttributeError as e:
-                        logger.warning(
-                            f"Skipping tool call in history due to missing attributes: {tc_instance}, error: {e}"
-                        )
-                    except Exception as e:
-                        logger.warning(
-                            f"Error processing tool call for history: {tc_instance}, error: {e}"
-                        )
-
-                if clean_tool_calls_for_history:  # Only add if list is not empty
-                    history_assistant_msg["tool_calls"] = clean_tool_calls_for_history
-
-            messages.append(history_assistant_msg)
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": content,
+                    "tool_calls": history_tool_calls,
+                }
+            )
 
             # Add tool calls to collection for exchange tracking
             all_tool_calls.extend(tool_calls)
 
-            # Execute each tool call and add results to messages
-            for (
-                tool_call
-            ) in (
-                tool_calls
-            ):  # tool_calls here is from parse_tool_calls(), a list of dicts
+            # Execute the tool calls in worker threads: read-only calls run
+            # concurrently, any other call runs on its own in the order given
+            # (see _schedule_tool_call). All are started first and the results
+            # collected in their original order. Calls that finished streaming
+            # before the rest of the response may be running already.
+            if len(tool_calls) == 1 and not started_tool_tasks:
+                # Most turns have a single tool call: nothing to run alongside it,
+                # so await it directly instead of scheduling a task
+                tool_tasks = [
+                    asyncio.to_thread(_execute_tool_call, tool_calls[0], tools_by_name)
+                ]
+            else:
+                tool_tasks = [
+                    started_tool_tasks.pop(tool_call["id"], None)
+                    or _schedule_tool_call(
+                        tool_call, tools_by_name, semaphore, scheduled_tools
+                    )
+                    for tool_call in tool_calls
+                ]
+            for tool_call, tool_task in zip(tool_calls, tool_tasks):
                 tool_name = tool_call["name"]
                 tool_args = tool_call["arguments"]
 
-                logger.debug(f"Executing tool: {tool_name}")
-                tool_result_for_history = ""
-
-                # General tool execution: find the tool by name and call its executor
-                matched_tool = None
-                for tool in tools:
-                    schema = tool.get("schema")
-                    logger.debug(f"Checking tool: {schema}")
-
-                    # LiteLLM tool schemas have a standard format: {"type": "function", "function": {...}}
-                    if isinstance(schema, dict):
-                        if schema.get("type") == "function" and isinstance(
-                            schema.get("function"), dict
-                        ):
-                            # Extract function name from the nested structure
-                            schema_name = schema.get("function", {}).get("name")
-                        else:
-                            # Direct name extraction (old format)
-                            schema_name = schema.get("name")
-                    elif hasattr(schema, "name") and schema is not None:
-                        schema_name = schema.name
-                    else:
-                        schema_name = None
-
-                    logger.debug(f"Tool name from schema: {schema_name}")
-
-                    if schema_name == tool_name:
-                        matched_tool = tool
-                        break
-                if matched_tool is not None:
-                    try:
-                        # Optionally, special handling if you want to yield the command first for shell
-                        if (
-                            tool_name == "shell_tool" or tool_name == "shell"
-                        ) and tool_args.get("command"):
-                            yield f"\n\n**$ {tool_args['command']}**\n"
-
-                        # Ensure the executor exists
-                        if "executor" not in matched_tool:
-                            error_msg = f"Error: Tool '{tool_name}' found but has no executor function"
-                            logger.error(error_msg)
-                            tool_result_for_history = error_msg
-                            truncated_output = truncate_tool_output_for_ui(error_msg)
-                            yield truncated_output
-                        else:
-                            tool_output = matched_tool["executor"](tool_args)
-                            # Store full output for LLM/history
-                            tool_result_for_history = (
-                                tool_output
-                                if isinstance(tool_output, str)
-                                else str(tool_output)
-                            )
-                            # Yield truncated output for UI
-                            truncated_output = truncate_tool_output_for_ui(tool_output)
-                            yield truncated_output
-                    except Exception as e:
-                        error_msg = f"Error executing {tool_name} tool: {str(e)}"
-                        logger.error(error_msg)
-                        logger.error(traceback.format_exc())
-                        tool_result_for_history = error_msg
-                        truncated_output = truncate_tool_output_for_ui(error_msg)
-                        yield truncated_output + "\n"
-                else:
-                    # List all available tools for debugging
-                    available_tools = []
-                    for t in tools:
-                        schema = t.get("schema")
-                        if isinstance(schema, dict):
-                            if schema.get("type") == "function" and isinstance(
-                                schema.get("function"), dict
-                            ):
-                                available_tools.append(
-                                    schema.get("function", {}).get("name")
-                                )
-                            else:
-                                available_tools.append(schema.get("name"))
-                        elif hasattr(schema, "name") and schema is not None:
-                            available_tools.append(schema.name)
-
-                    error_msg = f"Error: Tool '{tool_name}' not found. Available tools: {', '.join(available_tools) if available_tools else 'None'}"
-                    logger.error(error_msg)
-                    tool_result_for_history = error_msg
-                    truncated_output = truncate_tool_output_for_ui(error_msg)
-                    yield truncated_output + "\n"
+                # For shell commands, show the command before its output
+                if (
+                    tool_name == "shell_tool" or tool_name == "shell"
+                ) and tool_args.get("command"):
+                    yield _SHELL_COMMAND_HEADER(tool_args["command"])
+
+                tool_result_for_history, truncated_output = await tool_task
+                yield truncated_output
+
+                if (
+                    TOOL_RESULT_SUMMARY_MODEL
+                    and len(tool_result_for_history) > _TOOL_RESULT_SUMMARY_THRESHOLD
+                ):
+                    tool_result_for_history = await _summarize_tool_result(
+                        tool_result_for_history,
+                        _latest_user_text(messages),
+                        base_completion_params["api_key"],
+                    )
 
                 # Add the tool result to messages for the next LLM call
                 logger.debug(
-                    f"Adding tool result to messages: {tool_result_for_history}"
+                    "Adding tool result to messages: %s", tool_result_for_history
                 )
                 messages.append(
                     {
@@ -693,13 +1189,21 @@ def agent_loop(
             # for the LLM to process the tool results.
 
         except Exception as e:
-            logger.error(f"Error in agent loop: {str(e)}\n{traceback.format_exc()}")
+            logger.error(f"Error in agent loop: {str(e)}", exc_info=True)
             yield f"Error: {str(e)}"
             # Complete exchange with error if there's an exception
             if exchange:
                 error_message = {"content": f"Error: {str(e)}", "role": "assistant"}
                 exchange.complete(error_message, all_tool_calls)
             return
+        finally:
+            # Tool calls that were started but never awaited, e.g. because the
+            # stream failed or was cut off, or the caller stopped reading
+            for task in [*started_tool_tasks.values(), *tool_tasks]:
+                if asyncio.isfuture(task):
+                    task.cancel()
+                else:
+                    task.close()
 
     notice = f'I\'ve done {max_iterations} steps. Type "continue" or "next" to continue. You can change this, recursion_limit, in config.ini.'
     # If we've reached max iterations, complete the exchange
@@ -6,6 +6,7 @@ Handles chat IDs, project directories, and session management.
 import logging
 import secrets
 import string
+import time
 from typing import Callable, Dict, List, Optional
 
 from .project import Project
@@ -68,8 +69,6 @@ class Chat:
 
     def _generate_chat_id(self) -> str:
         """Generate a new random chat ID."""
-        import time
-
         # Add a timestamp prefix to ensure uniqueness
         timestamp = (
             int(time.time() * 1000) % 10000
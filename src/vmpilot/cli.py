@@ -22,16 +22,8 @@ try:
 except ImportError:
     COVERAGE_AVAILABLE = False
 
-# Configure basic logging as early as possible
-log_level = os.environ.get("PYTHONLOGLEVEL", "INFO")
-log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-logging.basicConfig(level=getattr(logging, log_level), format=log_format)
-logging.getLogger("vmpilot").setLevel(getattr(logging, log_level))
-
-# Explicitly silence specific loggers that might be noisy in CLI mode
-for logger_name in ["vmpilot.exchange", "vmpilot.agent", "vmpilot.agent_logging"]:
-    # set to INFO when debugging
-    logging.getLogger(logger_name).setLevel(logging.WARNING)
+# Loggers that are noisy in CLI mode
+NOISY_LOGGERS = ["vmpilot.exchange", "vmpilot.agent", "vmpilot.agent_logging"]
 
 
 # Add parent directory to Python path when running as script
@@ -124,6 +116,25 @@ def create_mock_messages(command: str, chat_id: Optional[str] = None) -> List[Di
     return messages
 
 
+def print_complete_lines(text: str, skip_patterns: List[str]) -> str:
+    """
+    Print the complete lines of streamed output, leaving out command echoes
+    and other lines that match skip_patterns.
+
+    Args:
+        text: Output received so far that hasn't been printed yet
+        skip_patterns: Lines containing any of these are not printed
+
+    Returns:
+        The trailing partial line, to be completed by the next piece of output
+    """
+    *lines, partial = text.split("\n")
+    for line in lines:
+        if not any(pattern in line for pattern in skip_patterns):
+            print(line, flush=True)
+    return partial
+
+
 async def process_command(
     command: str,
     temperature: float,
@@ -166,6 +177,13 @@ async def process_command(
         body=body,
     )
 
+    # Skip command echoes and certain system messages
+    skip_patterns = [
+        pattern for pattern in (command.strip(), "Executing command", "['ls") if pattern
+    ]
+    # Streamed text not printed yet: lines are filtered once they are complete
+    pending = ""
+
     # Print each message in the stream
     try:
         for msg in result:
@@ -194,17 +212,20 @@ async def process_command(
                     if error:
                         print(f"Error: {error}", end="\n", flush=True)
             else:
-                # Handle error messages and other string outputs
-                msg_str = str(msg).strip()
-                # Skip empty messages, command echoes, and certain system messages
-                skip_patterns = [command, "Executing command", "['ls"]
-
-                if msg_str and not any(pattern in msg_str for pattern in skip_patterns):
-                    # Handle error messages differently (no newline at end)
-                    if msg_str.startswith("Error:"):
-                        print(msg_str, flush=True)
-                    else:
-                        print(msg_str, end="\n", flush=True)
+                # String outputs are consecutive pieces of the response, the LLM
+                # text arrives a few tokens at a time, so print it line by line
+                msg_str = str(msg)
+                if msg_str.startswith("Error:"):
+                    # Finish the pending line first, then show the error on its own
+                    if pending:
+                        print_complete_lines(pending + "\n", skip_patterns)
+                        pending = ""
+                    print(msg_str, flush=True)
+                else:
+                    pending = print_complete_lines(pending + msg_str, skip_patterns)
+        # The streamed text doesn't necessarily end with a newline
+        if pending:
+            print_complete_lines(pending + "\n", skip_patterns)
     except Exception as e:
         print(f"\nError: {str(e)}", file=sys.stderr)
         sys.exit(1)
@@ -217,9 +238,15 @@ def main() -> None:
     # Import logging configuration
     from vmpilot.logging_config import configure_logging
 
-    # Configure logging first
+    # Configure logging first. This is done here rather than at import time so
+    # that importing the CLI module does not change the global logging setup.
     configure_logging()
 
+    # Explicitly silence specific loggers that might be noisy in CLI mode
+    for logger_name in NOISY_LOGGERS:
+        # set to INFO when debugging
+        logging.getLogger(logger_name).setLevel(logging.WARNING)
+
     # Import database module for cleanup
     from vmpilot.db import close_db_connection
 
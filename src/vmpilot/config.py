@@ -3,6 +3,7 @@ Configuration management for VMPilot providers and models.
 Uses configuration from config.ini in the root directory.
 """
 
+import functools
 import logging
 import os
 from configparser import ConfigParser
@@ -213,6 +214,20 @@ class GitConfig(BaseModel):
     )
 
 
+@functools.lru_cache(maxsize=None)
+def _read_api_key_file(key_path: str) -> str:
+    """Read an API key file once: the key is looked up for every LLM request.
+
+    Raises:
+        ConfigError: If the file cannot be read. Failures are not cached.
+    """
+    try:
+        with open(key_path, "r") as f:
+            return f.read().strip()
+    except Exception as e:
+        raise ConfigError(f"Failed to read API key from {key_path}: {str(e)}")
+
+
 class ModelConfig(BaseModel):
     """Global model configuration"""
 
@@ -223,10 +238,12 @@ class ModelConfig(BaseModel):
     pricing_display: PricingDisplay = Field(default=PricingDisplay.DETAILED)
     database_config: DatabaseConfig = Field(default_factory=DatabaseConfig)
 
-    def __init__(self):
+    def __init__(self, parser: Optional[ConfigParser] = None):
         try:
-            # Reload config to ensure we have fresh data
-            parser = load_config()
+            # Reload config to ensure we have fresh data, unless the caller
+            # passes a parser it has just loaded
+            if parser is None:
+                parser = load_config()
 
             # Read from config.ini
             default_provider = parser.get(
@@ -389,13 +406,7 @@ class ModelConfig(BaseModel):
         if provider_config.api_key_path:
             key_path = os.path.expanduser(provider_config.api_key_path)
             if os.path.exists(key_path):
-                try:
-                    with open(key_path, "r") as f:
-                        return f.read().strip()
-                except Exception as e:
-                    raise ConfigError(
-                        f"Failed to read API key from {key_path}: {str(e)}"
-                    )
+                return _read_api_key_file(key_path)
 
         raise ConfigError(
             f"No API key found for provider {provider}. Set environment variable {provider_config.api_key_env} or create key file at {provider_config.api_key_path}"
@@ -436,8 +447,9 @@ class ModelConfig(BaseModel):
         return hasattr(self, "database_config") and self.database_config.enabled
 
 
-# Global configuration instance
-config = ModelConfig()
+# Global configuration instance, built from the file loaded above instead of
+# finding and parsing it a second time
+config = ModelConfig(parser)
 
 # Google Search configuration
 google_search_config = GoogleSearchConfig.from_config(parser)
@@ -451,6 +463,12 @@ logger.debug(
 # General configuration
 DEFAULT_PROVIDER = parser.get("general", "default_provider")
 TOOL_OUTPUT_LINES = parser.getint("general", "tool_output_lines")
+# Seconds to reuse the output of read-only shell commands, 0 disables the cache
+SHELL_CACHE_TTL = parser.getfloat("general", "shell_cache_ttl", fallback=0)
+# Requests answered at the same time, each on its own worker thread
+MAX_CONCURRENT_RESPONSES = max(
+    parser.getint("general", "max_concurrent_responses", fallback=32), 1
+)
 DEFAULT_PROJECT = os.path.expanduser(
     parser.get("general", "default_project", fallback="~/vmpilot")
 )
@@ -466,4 +484,16 @@ current_provider: ContextVar[Optional[Provider]] = ContextVar(
 # Inference parameters
 TEMPERATURE = parser.getfloat("inference", "temperature")
 MAX_TOKENS = parser.getint("inference", "max_tokens")
+# Stream LLM responses, turned off for providers that can't stream tool calls
+STREAM_RESPONSES = parser.getboolean("inference", "stream", fallback=True)
+# Reuse LLM responses for identical requests (opt-in, see config.ini)
+RESPONSE_CACHE = parser.getboolean("inference", "response_cache", fallback=False)
+# Output token limit for the requests that follow tool results, 0 uses max_tokens
+FOLLOWUP_MAX_TOKENS = parser.getint("inference", "followup_max_tokens", fallback=0)
+# Token budget for the history sent to the LLM, 0 sends the full history
+HISTORY_TOKEN_BUDGET = parser.getint("inference", "history_token_budget", fallback=0)
+# Small model that condenses large tool results for the history, empty disables
+TOOL_RESULT_SUMMARY_MODEL = parser.get(
+    "inference", "tool_result_summary_model", fallback=""
+)
 RECURSION_LIMIT = parser.getint("model", "recursion_limit")
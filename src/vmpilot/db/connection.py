@@ -17,6 +17,15 @@ logger = logging.getLogger(__name__)
 # Singleton connection instance
 _db_connection: Optional[sqlite3.Connection] = None
 
+# Applied to every new connection. With the write-ahead log, reads don't wait
+# for a write to finish, and commits sync the disk at checkpoints rather than
+# on every write (still safe against application crashes).
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+)
+
 
 def close_db_connection() -> None:
     """
@@ -148,6 +157,12 @@ def get_db_connection() -> sqlite3.Connection:
             check_same_thread=False,  # Allow access from multiple threads
         )
         _db_connection.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            try:
+                _db_connection.execute(pragma)
+            except sqlite3.Error as e:
+                # e.g. a filesystem without shared memory support for WAL
+                logger.warning(f"Could not apply {pragma}: {e}")
 
         # Initialize database if it's a new database
         if not db_exists:
@@ -8,10 +8,10 @@ storing and retrieving chats and messages in a SQLite database.
 import json
 import logging
 import os
-import traceback
 from typing import Dict, List, Optional, Tuple
 
 from vmpilot.db.connection import get_db_connection
+from vmpilot.utils import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
 
@@ -42,8 +42,6 @@ class ConversationRepository:
             start: Start timestamp (ISO string).
             end: End timestamp (ISO string).
         """
-        import json
-
         cursor = self.conn.cursor()
         try:
             cursor.execute(
@@ -55,7 +53,7 @@ class ConversationRepository:
                     chat_id,
                     model,
                     request,
-                    json.dumps(cost),
+                    json_dumps(cost),
                     start,
                     end,
                 ),
@@ -63,8 +61,7 @@ class ConversationRepository:
             self.conn.commit()
             logger.debug(f"Inserted exchange for chat_id={chat_id}")
         except Exception as e:
-            logger.error(f"Failed to insert exchange: {e}")
-            traceback.print_exc()
+            logger.error(f"Failed to insert exchange: {e}", exc_info=True)
 
     def create_chat(self, chat_id: str, initial_request: Optional[str] = None) -> None:
         """
@@ -119,16 +116,15 @@ class ConversationRepository:
         try:
             serializable = messages
 
-            return json.dumps(serializable)
+            return json_dumps(serializable)
         except Exception as e:
-            logger.error(f"Error serializing messages: {e}")
-            traceback.print_exc()
+            logger.error(f"Error serializing messages: {e}", exc_info=True)
             return "[]"
 
     def deserialize_messages(self, json_str: str) -> List[Dict]:
         """Deserialize JSON string back to list of message dictionaries."""
         try:
-            data = json.loads(json_str)
+            data = json_loads(json_str)
             return data
         except Exception as e:
             logger.error(f"Error deserializing messages: {e}")
@@ -159,7 +155,7 @@ class ConversationRepository:
 
             # Serialize messages and cache_info
             serialized_messages = self.serialize_messages(messages)
-            serialized_cache_info = json.dumps(cache_info)
+            serialized_cache_info = json_dumps(cache_info)
 
             cursor = self.conn.cursor()
 
@@ -180,6 +176,66 @@ class ConversationRepository:
         except Exception as e:
             logger.error(f"Error saving conversation state to database: {e}")
 
+    def save_with_merged_cache_info(
+        self,
+        chat_id: str,
+        messages: List,
+        cache_info: Optional[Dict[str, int]] = None,
+    ) -> Dict[str, int]:
+        """
+        Save the conversation state, keeping stored cache info keys that
+        cache_info doesn't set.
+
+        Only the cache_info column is read back, not the message history, and
+        the merged state is written in the same transaction.
+
+        Args:
+            chat_id: The unique identifier for the conversation thread
+            messages: List of messages representing the conversation state
+            cache_info: Dictionary containing cache token information (optional)
+
+        Returns:
+            Dict[str, int]: The cache info that was saved
+        """
+        merged_cache_info = dict(cache_info or {})
+        if chat_id is None:
+            logger.warning("Cannot save conversation state: chat_id is None")
+            return merged_cache_info
+
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.execute(
+                    "SELECT cache_info FROM chats WHERE chat_id = ?", (chat_id,)
+                )
+                row = cursor.fetchone()
+                if row and row[0]:
+                    try:
+                        existing_cache_info = json_loads(row[0])
+                    except json.JSONDecodeError as e:
+                        logger.error(f"Error decoding cache info: {e}, ignoring it")
+                        existing_cache_info = {}
+                    merged_cache_info = {**existing_cache_info, **merged_cache_info}
+
+                cursor.execute(
+                    """
+                    INSERT OR REPLACE INTO chats
+                    (chat_id, messages, cache_info, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    """,
+                    (
+                        chat_id,
+                        self.serialize_messages(messages),
+                        json_dumps(merged_cache_info),
+                    ),
+                )
+            logger.debug(
+                f"Saved conversation state to database for chat_id {chat_id}: {len(messages)} messages"
+            )
+        except Exception as e:
+            logger.error(f"Error saving conversation state to database: {e}")
+        return merged_cache_info
+
     def get_conversation_state(self, chat_id: str) -> Tuple[List, Dict[str, int]]:
         """
         Retrieve the conversation state for a given chat_id from the database.
@@ -227,7 +283,7 @@ class ConversationRepository:
                     cache_info = {}
                 else:
                     try:
-                        cache_info = json.loads(serialized_cache_info)
+                        cache_info = json_loads(serialized_cache_info)
                     except json.JSONDecodeError as e:
                         logger.error(
                             f"Error decoding cache info: {e}, using empty dict"
@@ -263,7 +319,7 @@ class ConversationRepository:
             return
 
         # Serialize cache_info
-        serialized_cache_info = json.dumps(cache_info)
+        serialized_cache_info = json_dumps(cache_info)
 
         cursor = self.conn.cursor()
         cursor.execute(
@@ -310,15 +366,13 @@ class ConversationRepository:
         """
         Returns the sum of total_cost for all exchanges for a given chat_id.
         """
-        import json
-
         cursor = self.conn.cursor()
         try:
             cursor.execute("SELECT cost FROM exchanges WHERE chat_id = ?", (chat_id,))
             total = 0.0
             for row in cursor.fetchall():
                 try:
-                    cost_data = json.loads(row[0])
+                    cost_data = json_loads(row[0])
                     total += float(cost_data.get("total_cost", 0.0))
                 except Exception as e:
                     logger.warning(f"Could not parse cost row: {e}")
@@ -334,8 +388,6 @@ class ConversationRepository:
         cache_creation_cost, total_cost (matching per-exchange breakdown).
         Missing fields are treated as 0.0.
         """
-        import json
-
         fields = [
             "input_cost",
             "output_cost",
@@ -349,7 +401,7 @@ class ConversationRepository:
             cursor.execute("SELECT cost FROM exchanges WHERE chat_id = ?", (chat_id,))
             for row in cursor.fetchall():
                 try:
-                    cost_data = json.loads(row[0])
+                    cost_data = json_loads(row[0])
                     for field in fields:
                         sums[field] += float(cost_data.get(field, 0.0))
                 except Exception as e:
@@ -102,10 +102,56 @@ def build_litellm_config(
     }
 
 
+def _without_cache_control(message):
+    """Return the message without cache_control, copying it only if it has any."""
+    content = message.get("content")
+    blocks_marked = isinstance(content, list) and any(
+        isinstance(block, dict) and "cache_control" in block for block in content
+    )
+    if "cache_control" not in message and not blocks_marked:
+        return message
+
+    message = {key: value for key, value in message.items() if key != "cache_control"}
+    if blocks_marked:
+        message["content"] = [
+            (
+                {key: value for key, value in block.items() if key != "cache_control"}
+                if isinstance(block, dict)
+                else block
+            )
+            for block in content
+        ]
+    return message
+
+
+def _with_cache_control(message):
+    """
+    Return a copy of the message with a cache breakpoint, or None if it has no
+    text to put one on.
+    """
+    message = dict(_without_cache_control(message))
+    content = message.get("content")
+    if isinstance(content, list):
+        # Mark the first text block only
+        for index, block in enumerate(content):
+            if isinstance(block, dict) and block.get("type") == "text":
+                content = list(content)
+                content[index] = {**block, "cache_control": {"type": "ephemeral"}}
+                message["content"] = content
+                return message
+    elif isinstance(content, str):
+        # For string content, add cache_control at message level to avoid creating extra blocks
+        message["cache_control"] = {"type": "ephemeral"}
+        return message
+    return None
+
+
 def modify_state_messages(messages):
     """
     For Anthropic: Add cache_control to last 3 messages (LiteLLM format).
-    This function modifies messages in place for cache control in Anthropic.
+
+    Returns a new list. The messages that get or lose cache_control are
+    copied, so the conversation history passed in is never modified.
 
     Anthropic allows max 4 blocks with cache_control (system prompt uses 1, so 3 for messages).
     """
@@ -113,47 +159,24 @@ def modify_state_messages(messages):
     if provider is None or provider != APIProvider.ANTHROPIC:
         return messages
 
-    logger.debug("Applying cache control to last 3 messages for Anthropic")
-    # PHASE 1: Clear ALL cache_control from ALL messages first
-    for message in messages:
-        # Remove cache_control from message level
-        message.pop("cache_control", None)
-
-        # Remove cache_control from content blocks
-        content = message.get("content")
-        if isinstance(content, list):
-            for block in content:
-                if isinstance(block, dict) and "cache_control" in block:
-                    block.pop("cache_control", None)
-
-    # PHASE 2: Apply cache_control to last 3 messages only
-    cached = 3
-    messages_to_cache = messages[-cached:] if len(messages) >= cached else messages
-
-    for message in reversed(messages_to_cache):
-        if cached > 0:
-            content = message.get("content")
-            if isinstance(content, list):
-                # Find the first text block and add cache_control to it only
-                for block in content:
-                    if isinstance(block, dict) and block.get("type") == "text":
-                        block["cache_control"] = {"type": "ephemeral"}
-                        cached -= 1
-                        logger.debug(
-                            f"Added cache_eph to list content blocks for message: {message}"
-                        )
-                        if cached <= 0:
-                            break
-            elif isinstance(content, str):
-                logger.debug(f"Added cache_eph to str for message: {message}")
-                # For string content, add cache_control at message level to avoid creating extra blocks
-                message["cache_control"] = {"type": "ephemeral"}
-                cached -= 1
+    # Earlier messages keep no cache_control. Histories saved before this
+    # function stopped modifying them may still carry some.
+    tail_start = max(len(messages) - 3, 0)
+    modified = [_without_cache_control(message) for message in messages[:tail_start]]
+
+    cached = 0
+    for message in messages[tail_start:]:
+        marked = _with_cache_control(message)
+        if marked is None:
+            modified.append(_without_cache_control(message))
+        else:
+            modified.append(marked)
+            cached += 1
 
     logger.debug(
-        f"[LiteLLM] Applied cache control to last {3-cached} messages for Anthropic"
+        "[LiteLLM] Applied cache control to last %d messages for Anthropic", cached
     )
-    return messages
+    return modified
 
 
 # For API symmetry with agent.py
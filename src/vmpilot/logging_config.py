@@ -1,24 +1,30 @@
 import logging
 import os
 
+# Filter out 'stream_content:Generator:' messages, and 'stream:true:<generator
+# object' messages from pipelines main.py
+_FILTERED_MESSAGES = ("stream_content:Generator:", "stream:true:<generator object")
+
 
 class StreamContentFilter(logging.Filter):
     """Filter out stream-related log messages from the root logger."""
 
     def filter(self, record):
-        if record.name == "root":
-            message = record.getMessage()
-            # Filter out 'stream_content:Generator:' messages
-            if "stream_content:Generator:" in message:
-                return False
-            # Filter out 'stream:true:<generator object' messages from pipelines main.py
-            if "stream:true:<generator object" in message:
-                return False
-        return True
+        if record.name != "root":
+            return True
+        # Check the unformatted message first: a record without args needs no
+        # formatting, so most records are decided without getMessage()
+        message = str(record.msg)
+        if any(text in message for text in _FILTERED_MESSAGES):
+            return False
+        if not record.args:
+            return True
+        message = record.getMessage()
+        return not any(text in message for text in _FILTERED_MESSAGES)
 
 
 def configure_logging():
-    """Configure logging with custom filters."""
+    """Configure logging with custom filters. Safe to call more than once."""
     # Get log level from environment variable
     log_level = os.environ.get("PYTHONLOGLEVEL", "INFO")
 
@@ -28,9 +34,11 @@ def configure_logging():
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     )
 
-    # Add filter to root logger to remove 'stream_content:Generator:' messages
+    # Add filter to root logger to remove 'stream_content:Generator:' messages.
+    # Both the pipeline module and the CLI call this, so add it only once.
     root_logger = logging.getLogger()
-    root_logger.addFilter(StreamContentFilter())
+    if not any(isinstance(f, StreamContentFilter) for f in root_logger.filters):
+        root_logger.addFilter(StreamContentFilter())
 
     # Set up vmpilot module logger
     vmpilot_logger = logging.getLogger("vmpilot")
@@ -32,21 +32,9 @@ def save_conversation_state(
         logger.warning("Cannot save conversation state: thread_id is None")
         return
 
-    # If no cache_info is provided, retrieve any existing cache_info
-    if cache_info is None:
-        _, existing_cache_info = _repo.get_conversation_state(thread_id)
-        cache_info = existing_cache_info or {}
-    else:
-        # Merge with existing cache_info if it exists
-        _, existing_cache_info = _repo.get_conversation_state(thread_id)
-        if existing_cache_info:
-            # Use the new cache_info but preserve any existing keys not in the new one
-            for key, value in existing_cache_info.items():
-                if key not in cache_info:
-                    cache_info[key] = value
-
-    # Save to database
-    _repo.save_conversation_state(thread_id, messages, cache_info)
+    # Save to database, keeping any existing cache_info keys not in the new one.
+    # This reads back only the stored cache_info, not the whole history.
+    cache_info = _repo.save_with_merged_cache_info(thread_id, messages, cache_info)
 
     logger.debug(
         f"Saved conversation state to database for thread_id {thread_id}: {len(messages)} messages, cache_info: {cache_info}"
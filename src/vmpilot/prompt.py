@@ -2,6 +2,7 @@
 Prompt for the agent
 """
 
+import functools
 import logging
 import pathlib
 import platform
@@ -23,7 +24,12 @@ logger = logging.getLogger(__name__)
 
 # Read plugins README.md
 def get_plugins_readme():
-    plugins_readme_path = pathlib.Path(get_plugins_dir()) / "README.md"
+    return _read_plugins_readme(pathlib.Path(get_plugins_dir()) / "README.md")
+
+
+@functools.lru_cache(maxsize=8)
+def _read_plugins_readme(plugins_readme_path):
+    """Read the plugins README once per path: it ships with VMPilot."""
     try:
         with open(plugins_readme_path, "r") as f:
             logger.debug(f"Loaded plugins README from {plugins_readme_path}")
@@ -33,31 +39,56 @@ def get_plugins_readme():
         return "No plugins available"
 
 
-def get_available_tools_description():
-    """Generate a description of available tools based on actual configuration."""
+@functools.lru_cache(maxsize=None)
+def _read_provider_prompt(provider_name):
+    """Read the provider-specific prompt file once: it ships with VMPilot."""
+    prompt_file = pathlib.Path(__file__).parent / "prompts" / f"{provider_name}.md"
+    if not prompt_file.exists():
+        return ""
+    try:
+        with open(prompt_file, "r") as f:
+            provider_prompt = f.read()
+        logger.debug(f"Loaded provider-specific prompt from {prompt_file}")
+        return provider_prompt
+    except Exception as e:
+        logger.warning(f"Failed to read prompt file {prompt_file}: {e}")
+        return ""
+
+
+@functools.lru_cache(maxsize=1)
+def _build_tools_description():
+    """
+    Describe the configured tools. The tools only depend on the configuration,
+    so this is built once and the system prompt keeps the same text, and the
+    same cacheable prefix, across requests. Exceptions are not cached.
+    """
     from vmpilot.tools.setup_tools import setup_tools
 
-    try:
-        tools = setup_tools()
-        if not tools:
-            return "No tools are currently available."
-
-        tool_descriptions = []
-        for tool in tools:
-            schema = tool.get("schema", {})
-            if schema.get("type") == "function":
-                func_info = schema.get("function", {})
-                name = func_info.get("name", "Unknown")
-                description = func_info.get("description", "No description available")
-                tool_descriptions.append(
-                    f"* Use the {name} tool for {description.split('.')[0].lower()}."
-                )
-
-        if tool_descriptions:
-            return "\n".join(tool_descriptions)
-        else:
-            return "Tools are available but descriptions could not be generated."
+    tools = setup_tools()
+    if not tools:
+        return "No tools are currently available."
+
+    tool_descriptions = []
+    for tool in tools:
+        schema = tool.get("schema", {})
+        if schema.get("type") == "function":
+            func_info = schema.get("function", {})
+            name = func_info.get("name", "Unknown")
+            description = func_info.get("description", "No description available")
+            tool_descriptions.append(
+                f"* Use the {name} tool for {description.split('.')[0].lower()}."
+            )
+
+    if tool_descriptions:
+        return "\n".join(tool_descriptions)
+    else:
+        return "Tools are available but descriptions could not be generated."
+
 
+def get_available_tools_description():
+    """Generate a description of available tools based on actual configuration."""
+    try:
+        return _build_tools_description()
     except Exception as e:
         logger.warning(f"Failed to get tools description: {e}")
         return "* Use the shell tool for executing bash commands.\n* Use the create_file tool for creating files.\n* Use the edit_file tool for editing files."
@@ -145,18 +176,8 @@ This is the current issue we're working on. You do not need to fetch it again.
         provider_name = "google"
 
     # Try to load a prompt file for the provider
-    prompts_dir = pathlib.Path(__file__).parent / "prompts"
-    prompt_file = prompts_dir / f"{provider_name}.md"
-    provider_prompt = ""
-    if prompt_file.exists():
-        try:
-            with open(prompt_file, "r") as f:
-                provider_prompt = f.read()
-            logger.debug(f"Loaded provider-specific prompt from {prompt_file}")
-        except Exception as e:
-            logger.warning(f"Failed to read prompt file {prompt_file}: {e}")
-            provider_prompt = ""
-    logger.debug(f"Provider prompt: {provider_prompt}")
+    provider_prompt = _read_provider_prompt(provider_name)
+    logger.debug("Provider prompt: %s", provider_prompt)
 
     prompt += provider_prompt
 
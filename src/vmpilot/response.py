@@ -1,21 +1,57 @@
 """
 response.py for LiteLLM implementation
 Generates responses from the LLM and tools, handling streaming and output callbacks.
-This module calls the agent_loop from lllm_agent.py.
+This module calls the agent_loop from agent.py.
 """
 
 import asyncio
 import logging
 import queue
 import threading
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from typing import Generator
 
-from vmpilot.agent import process_messages
-from vmpilot.config import MAX_TOKENS, RECURSION_LIMIT, TEMPERATURE, TOOL_OUTPUT_LINES
+from vmpilot.agent import process_messages, truncate_tool_output_for_ui
+from vmpilot.config import (
+    MAX_CONCURRENT_RESPONSES,
+    MAX_TOKENS,
+    RECURSION_LIMIT,
+    TEMPERATURE,
+)
 
 logger = logging.getLogger(__name__)
 
+# Put on the output queue by the worker thread once it has finished
+_DONE = object()
+
+# Worker threads driving the agent. Each serves one request at a time and keeps
+# its event loop between requests, so neither is set up again for every request.
+# Requests beyond MAX_CONCURRENT_RESPONSES wait for a free worker.
+_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_RESPONSES, thread_name_prefix="vmpilot-response"
+)
+_worker_state = threading.local()
+
+
+def _handle_asyncio_exception(loop, context):
+    """Log exceptions the event loop could not pass on to anyone."""
+    exception = context.get("exception")
+    if exception:
+        logger.error(f"Caught asyncio exception: {exception}", exc_info=exception)
+    else:
+        logger.error(f"Asyncio error: {context['message']}")
+
+
+def _worker_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of the current worker thread, creating it once."""
+    loop = getattr(_worker_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_exception_handler(_handle_asyncio_exception)
+        _worker_state.loop = loop
+    return loop
+
 
 def generate_responses(
     body, pipeline_self, messages, system_prompt_suffix, formatted_messages
@@ -34,15 +70,18 @@ def generate_responses(
     Yields:
         Response chunks as they become available
     """
-    output_queue = queue.Queue()
-    loop_done = threading.Event()
-
-    # Extract the user input from formatted_messages
-    user_input = ""
-    for msg in formatted_messages:
-        if msg.get("role") == "user":
-            user_input = msg.get("content", "")
-            break
+    output_queue = queue.SimpleQueue()
+
+    # Extract the user input from formatted_messages: it is the latest user
+    # message, so scan from the end
+    user_input = next(
+        (
+            msg.get("content", "")
+            for msg in reversed(formatted_messages)
+            if msg.get("role") == "user"
+        ),
+        "",
+    )
 
     if not user_input:
         logger.error("No user input found in formatted_messages")
@@ -50,86 +89,67 @@ def generate_responses(
         return
 
     def handle_exception(e):
-        logger.error(f"Error: {e}")
-        logger.error("".join(traceback.format_tb(e.__traceback__)))
+        # The traceback is only formatted if a handler emits the record
+        logger.error(f"Error: {e}", exc_info=e)
         output_queue.put(f"Error: {str(e)}")
 
-    # Callbacks for LLM and tool outputs
+    # Callbacks for LLM and tool outputs. They run for every streamed piece, so
+    # the debug logs leave formatting to the logging module.
     def output_callback(content):
-        logger.debug(f"Received content: {content}")
+        logger.debug("Received content: %s", content)
         if isinstance(content, dict) and content.get("type") == "text":
-            logger.debug(f"Assistant: {content['text']}")
             output_queue.put(content["text"])
         elif isinstance(content, str):
             output_queue.put(content)
 
     def tool_callback(result, tool_id=None):
-        logger.debug(f"Tool callback received result: {result}")
-        outputs = []
-        if isinstance(result, dict):
-            if "error" in result and result["error"]:
-                outputs.append(result["error"])
-            if "output" in result and result["output"]:
-                outputs.append(result["output"])
-        elif hasattr(result, "error") and result.error:
-            if hasattr(result, "exit_code") and result.exit_code:
-                outputs.append(f"Exit code: {result.exit_code}")
-            outputs.append(result.error)
-        else:
-            outputs.append(str(result))
-        logger.debug("Tool callback queueing outputs:")
-        for output in outputs:
-            output_lines = str(output).splitlines()
-            truncated_output = "\n".join(output_lines[:TOOL_OUTPUT_LINES])
-            if len(output_lines) > (TOOL_OUTPUT_LINES + 1):
-                truncated_output += f"\n...\n````\n(and {len(output_lines) - TOOL_OUTPUT_LINES} more lines)\n"
-            else:
-                truncated_output += "\n"
-            output_queue.put(truncated_output)
+        logger.debug("Tool callback received result: %s", result)
+        output_queue.put(truncate_tool_output_for_ui(result))
+
+    # Event loop and task of the worker thread, so the consumer can cancel it.
+    # The consumer may stop before the worker gets to start the task, so it
+    # also sets "cancelled", and the lock orders that against starting it.
+    worker = {"cancelled": False}
+    worker_lock = threading.Lock()
 
     def run_loop():
         loop = None
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-            # Set exception handler for the loop to catch unhandled exceptions
-            def handle_asyncio_exception(loop, context):
-                exception = context.get("exception")
-                if exception:
-                    logger.error(f"Caught asyncio exception: {exception}")
-                    logger.error("".join(traceback.format_tb(exception.__traceback__)))
-                else:
-                    logger.error(f"Asyncio error: {context['message']}")
-
-            loop.set_exception_handler(handle_asyncio_exception)
+            loop = _worker_loop()
 
             model = pipeline_self.valves.model
             provider = getattr(pipeline_self.valves.provider, "value", None)
             api_key = getattr(pipeline_self, "_api_key", None)
-            # Build messages and params for process_messages
-            coroutine = process_messages(
-                model=model,
-                provider=provider,
-                system_prompt_suffix=system_prompt_suffix,
-                messages=formatted_messages,
-                output_callback=output_callback,
-                tool_output_callback=tool_callback,
-                api_key=api_key,
-                max_tokens=MAX_TOKENS,
-                temperature=TEMPERATURE,
-                disable_logging=body.get("disable_logging", False),
-                recursion_limit=RECURSION_LIMIT,
-            )
-            loop.run_until_complete(coroutine)
+            with worker_lock:
+                if worker["cancelled"]:
+                    logger.info("Response generation cancelled before it started")
+                    return
+                # Build messages and params for process_messages
+                coroutine = process_messages(
+                    model=model,
+                    provider=provider,
+                    system_prompt_suffix=system_prompt_suffix,
+                    messages=formatted_messages,
+                    output_callback=output_callback,
+                    tool_output_callback=tool_callback,
+                    api_key=api_key,
+                    max_tokens=MAX_TOKENS,
+                    temperature=TEMPERATURE,
+                    disable_logging=body.get("disable_logging", False),
+                    recursion_limit=RECURSION_LIMIT,
+                )
+                task = loop.create_task(coroutine)
+                worker["loop"], worker["task"] = loop, task
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            logger.info("Response generation cancelled")
         except Exception as e:
             handle_exception(e)
         finally:
-            loop_done.set()
-            # Safely close the loop
+            # Leave the loop clean for the next request this worker serves
             if loop:
                 try:
-                    # Cancel all running tasks
+                    # Cancel tasks the agent left behind, e.g. tool calls
                     pending = asyncio.all_tasks(loop)
                     for task in pending:
                         task.cancel()
@@ -138,28 +158,35 @@ def generate_responses(
                         loop.run_until_complete(
                             asyncio.gather(*pending, return_exceptions=True)
                         )
-                    loop.close()
                 except Exception as e:
                     logger.warning(f"Error during loop cleanup: {e}")
+            # Wake up the consumer: nothing more will be queued after this
+            output_queue.put(_DONE)
 
-    # Start the sampling loop in a separate thread
-    thread = threading.Thread(target=run_loop)
-    thread.daemon = True
-    thread.start()
+    # Run the sampling loop on a worker thread. pipe() may be consumed from
+    # inside a running event loop (the CLI does this), so the coroutine cannot be
+    # driven in the caller's thread.
+    _executor.submit(run_loop)
 
-    # Yield responses from the queue
+    # Yield responses from the queue, blocking until each one arrives
     response_received = False
-    while not loop_done.is_set() or not output_queue.empty():
-        try:
-            output = output_queue.get(timeout=0.1)
+    try:
+        while True:
+            output = output_queue.get()
+            if output is _DONE:
+                break
             response_received = True
             yield output
-        except queue.Empty:
-            continue
-        except Exception as e:
-            handle_exception(e)
-            break
+    finally:
+        # If the consumer stopped reading early (e.g. the client disconnected),
+        # stop the agent instead of letting it run tools to completion unseen
+        with worker_lock:
+            worker["cancelled"] = True
+            task = worker.get("task")
+        if task is not None and not task.done():
+            # Worker loops stay open, so this cannot race with a close
+            worker["loop"].call_soon_threadsafe(task.cancel)
 
     # If no response was received and the loop is done, yield a default message
-    if not response_received and loop_done.is_set():
+    if not response_received:
         yield "Command executed but no response was generated."
@@ -31,8 +31,6 @@ class CreateFileTool:
     """Wrapper to provide class interface for test compatibility"""
 
     def run(self, args: Dict[str, Any]) -> str:
-        from pathlib import Path
-
         # Validate path
         path_str = args["path"] if isinstance(args, dict) and "path" in args else None
         if not path_str or path_str.strip() in ("", "."):
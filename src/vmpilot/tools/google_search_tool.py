@@ -1,5 +1,6 @@
 import logging
 import os
+from functools import lru_cache
 from typing import Any, Dict
 
 import requests
@@ -27,11 +28,34 @@ def google_search_executor(args: Dict[str, Any]) -> str:
     if not query:
         return "Error: No search query provided"
 
-    # Create GoogleSearchTool instance and execute search
-    search_tool = GoogleSearchTool()
+    # Reuse the shared GoogleSearchTool instance and execute search
+    search_tool = get_search_tool()
     return search_tool._run(query, num_results)
 
 
+def get_search_tool() -> "GoogleSearchTool":
+    """
+    Get a shared GoogleSearchTool instance.
+
+    The instance is only rebuilt when the configuration it was created from
+    (enabled flag and credentials) changes.
+
+    Returns:
+        GoogleSearchTool instance
+    """
+    return _cached_search_tool(
+        google_search_config.enabled,
+        os.getenv(google_search_config.api_key_env),
+        os.getenv(google_search_config.cse_id_env),
+    )
+
+
+@lru_cache(maxsize=1)
+def _cached_search_tool(enabled, api_key, cse_id) -> "GoogleSearchTool":
+    """Create the GoogleSearchTool for one configuration (the arguments are the cache key)."""
+    return GoogleSearchTool()
+
+
 class GoogleSearchTool:
     """Execute Google searches."""
 
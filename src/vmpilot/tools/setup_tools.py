@@ -3,7 +3,8 @@ Initialize and configure the tools we use as described in the prompt.
 """
 
 import logging
-import traceback
+import os
+import re
 
 from vmpilot.config import google_search_config
 from vmpilot.tools.create_file import create_file_executor, get_create_file_schema
@@ -14,6 +15,30 @@ from vmpilot.tools.shelltool import execute_shell_command, shell_tool
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Model family detection, matched case-insensitively in a single pass
+_CLAUDE_MODEL_RE = re.compile(r"claude|anthropic", re.IGNORECASE)
+_GEMINI_MODEL_RE = re.compile(r"gemini", re.IGNORECASE)
+
+# The core tools are the same for every request, so build their entries once.
+# shell_tool is already in the correct format with "type": "function"
+_CORE_TOOLS = (
+    {"schema": shell_tool, "executor": execute_shell_command},
+    {
+        "schema": {"type": "function", "function": get_create_file_schema()},
+        "executor": create_file_executor,
+    },
+    {
+        "schema": {"type": "function", "function": get_edit_file_schema()},
+        "executor": edit_file_executor,
+    },
+)
+
+_CLAUDE_SEARCH_SCHEMA = {
+    "type": "web_search_20250305",
+    "name": "web_search",
+    "max_uses": 5,
+}
+
 
 def is_google_search_enabled() -> bool:
     """Check if Google Search is enabled by verifying configuration and environment variables."""
@@ -36,8 +61,6 @@ def get_google_search_status() -> str:
     if not google_search_config.enabled:
         return "Google Search is disabled in configuration"
 
-    import os
-
     missing_vars = []
     if not os.getenv(google_search_config.api_key_env):
         missing_vars.append(str(google_search_config.api_key_env))
@@ -52,30 +75,17 @@ def get_google_search_status() -> str:
 
 def setup_tools(model: str | None = None):
     """Set up the tools used by the agent."""
-    tools = []
-
-    # Always add the core shell tool
-    # shell_tool is already in the correct format with "type": "function"
-    tools.append({"schema": shell_tool, "executor": execute_shell_command})
-
-    # Add create_file tool
-    create_file_schema = {"type": "function", "function": get_create_file_schema()}
-    tools.append({"schema": create_file_schema, "executor": create_file_executor})
-
-    # Add edit_file tool
-    edit_file_schema = {"type": "function", "function": get_edit_file_schema()}
-    tools.append({"schema": edit_file_schema, "executor": edit_file_executor})
+    # Always add the core tools: shell, create_file and edit_file
+    tools = list(_CORE_TOOLS)
 
     # Add Claude web search tool if using Claude model
     try:
         if model and is_claude_model(model):
-            claude_search_schema = {
-                "type": "web_search_20250305",
-                "name": "web_search",
-                "max_uses": 5,
-            }
             tools.append(
-                {"schema": claude_search_schema, "executor": claude_web_search_executor}
+                {
+                    "schema": _CLAUDE_SEARCH_SCHEMA,
+                    "executor": claude_web_search_executor,
+                }
             )
             logger.debug("Claude web search tool added to available tools")
     except Exception as e:
@@ -112,12 +122,9 @@ def setup_tools(model: str | None = None):
                         "Google Search Tool initialization failed, not adding to tools"
                     )
             except Exception as e:
-                logger.error(f"Error creating Google Search Tool: {e}")
-                logger.error("".join(traceback.format_tb(e.__traceback__)))
+                logger.error(f"Error creating Google Search Tool: {e}", exc_info=True)
         else:
             if google_search_config.enabled:
-                import os
-
                 missing_vars = []
                 if not os.getenv(google_search_config.api_key_env):
                     missing_vars.append(google_search_config.api_key_env)
@@ -134,8 +141,7 @@ def setup_tools(model: str | None = None):
                     "Google Search Tool not enabled in configuration, skipping"
                 )
     except Exception as e:
-        logger.error(f"Error creating tools: {e}")
-        logger.error("".join(traceback.format_tb(e.__traceback__)))
+        logger.error(f"Error creating tools: {e}", exc_info=True)
 
     # Return all tools
     return tools
@@ -145,14 +151,14 @@ def is_claude_model(model: str) -> bool:
     """Check if the model is a Claude model."""
     if not model:
         return False
-    return "claude" in model.lower() or "anthropic" in model.lower()
+    return _CLAUDE_MODEL_RE.search(model) is not None
 
 
 def is_gemini_model(model: str) -> bool:
     """Check if the model is a Gemini model."""
     if not model:
         return False
-    return "gemini" in model.lower() or model.lower().startswith("gemini-")
+    return _GEMINI_MODEL_RE.search(model) is not None
 
 
 def claude_web_search_executor(tool_args: dict) -> str:
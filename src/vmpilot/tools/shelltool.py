@@ -1,11 +1,184 @@
 """Tool for executing shell commands with proper output formatting."""
 
 import logging
+import os
+import re
+import signal
 import subprocess
-from typing import Any, Dict
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from vmpilot.config import SHELL_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
+# Read-only commands whose output can be reused for SHELL_CACHE_TTL seconds
+_CACHEABLE_COMMAND_RE = re.compile(
+    r"^\s*(ls|cat|head|tail|grep|wc|pwd|git (status|log|diff|show))\b"
+)
+# Chaining, redirection or substitution could hide a side effect
+_UNSAFE_SHELL_CHARS_RE = re.compile(r"[;&|<>`$\n]")
+_SHELL_CACHE_MAX_ENTRIES = 128
+
+# Seconds a command may run before it and everything it started are killed
+SHELL_TIMEOUT = 60
+
+# Bytes of stdout and of stderr kept per command. Far more than the agent
+# passes on to the model, so this only cuts pathological output (e.g. a
+# runaway find or a binary dump) that would otherwise all be held in memory.
+SHELL_OUTPUT_LIMIT = 1024 * 1024
+_PIPE_READ_SIZE = 64 * 1024
+# Seconds to wait for the rest of the output once the process group is gone
+_PIPE_GRACE_SECONDS = 1
+
+# (working directory, command, language) -> (time stored, formatted output).
+# The directory is part of the key because each chat works in its own project.
+_shell_cache: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+_shell_cache_lock = threading.Lock()
+# Bumped on every invalidation, so a read that ran while something changed
+# files doesn't store its possibly stale output afterwards
+_shell_cache_generation = 0
+
+
+def is_cacheable_command(command: str) -> bool:
+    """Check if a command only reads state, so its output may be cached."""
+    return bool(
+        _CACHEABLE_COMMAND_RE.match(command)
+        and not _UNSAFE_SHELL_CHARS_RE.search(command)
+    )
+
+
+def invalidate_shell_cache() -> None:
+    """Drop all cached command output, e.g. after something may have changed files."""
+    global _shell_cache_generation
+    with _shell_cache_lock:
+        _shell_cache.clear()
+        _shell_cache_generation += 1
+
+
+def _run_command(command: str, timeout: float) -> subprocess.CompletedProcess:
+    """
+    Run a command through bash and capture its output.
+
+    The command gets its own process group. On timeout the whole group is
+    killed: killing only the shell would leave background jobs and pipeline
+    members running and holding the output pipes open. A child that left the
+    group (e.g. through setsid) can't be killed this way; once the shell is
+    gone, such a child only delays the result by _PIPE_GRACE_SECONDS.
+
+    Output is read as bytes and decoded as UTF-8 in one pass, with invalid
+    bytes replaced, so binary output (e.g. cat of a compiled file) still
+    produces a result instead of a UnicodeDecodeError.
+
+    Each stream keeps at most SHELL_OUTPUT_LIMIT bytes (its start and end);
+    the rest is read and dropped, so the command still runs to completion.
+
+    Raises:
+        subprocess.TimeoutExpired: If the shell ran longer than timeout. It
+            carries the output captured until then.
+    """
+    # Pass bash its argv directly instead of having shell=True build it.
+    # Not used as a context manager: closing a pipe that a reader is still
+    # blocked on would wait for that reader, so each reader closes its own.
+    process = subprocess.Popen(
+        ["/bin/bash", "-c", command],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    readers = [
+        _BoundedReader(process.stdout, SHELL_OUTPUT_LIMIT),
+        _BoundedReader(process.stderr, SHELL_OUTPUT_LIMIT),
+    ]
+    for reader in readers:
+        reader.start()
+    deadline = time.monotonic() + timeout
+    timed_out = False
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+    # Background jobs may still hold the pipes open after the shell exits
+    for reader in readers:
+        reader.join(max(deadline - time.monotonic(), 0))
+    if timed_out or any(reader.is_alive() for reader in readers):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+        # Readers still blocked now are held by a child outside the group;
+        # they are left to finish in the background
+        deadline = time.monotonic() + _PIPE_GRACE_SECONDS
+        for reader in readers:
+            reader.join(max(deadline - time.monotonic(), 0))
+    stdout, stderr = (
+        reader.output().decode("utf-8", errors="replace") for reader in readers
+    )
+    if timed_out:
+        raise subprocess.TimeoutExpired(command, timeout, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+class _BoundedReader(threading.Thread):
+    """
+    Drain a pipe, keeping only the start and end of what it produces.
+
+    The reader closes the pipe when it reaches the end. A reader blocked by a
+    child that escaped the process group may be abandoned, so output() can be
+    called while it is still running.
+    """
+
+    def __init__(self, pipe, limit: int):
+        super().__init__(daemon=True)
+        self._pipe = pipe
+        self._head_limit = limit * 2 // 3
+        self._tail_limit = limit - self._head_limit
+        self._head = bytearray()
+        # Recent chunks; only the last _tail_limit bytes of them are kept
+        self._tail: Deque[bytes] = deque()
+        self._tail_size = 0
+        self._omitted = 0
+        self._lock = threading.Lock()
+
+    def run(self) -> None:
+        with self._pipe:
+            while True:
+                chunk = self._pipe.read1(_PIPE_READ_SIZE)
+                if not chunk:
+                    break
+                with self._lock:
+                    self._add(chunk)
+
+    def _add(self, chunk: bytes) -> None:
+        room = self._head_limit - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk:
+            return
+        self._tail.append(chunk)
+        self._tail_size += len(chunk)
+        while self._tail_size - len(self._tail[0]) >= self._tail_limit:
+            dropped = self._tail.popleft()
+            self._tail_size -= len(dropped)
+            self._omitted += len(dropped)
+
+    def output(self) -> bytes:
+        """Return the captured output, marking where bytes were dropped."""
+        with self._lock:
+            head = bytes(self._head)
+            tail = b"".join(self._tail)
+            omitted = self._omitted
+        excess = len(tail) - self._tail_limit
+        omitted += max(excess, 0)
+        if omitted:
+            marker = f"\n[... {omitted} bytes of output omitted ...]\n".encode()
+            return head + marker + tail[max(excess, 0) :]
+        return head + tail
+
 
 class ShellTool:
     """Wrapper to provide class interface for test compatibility"""
@@ -22,13 +195,9 @@ class ShellTool:
 def run_shell_command(command, language):
     """Executes the command and returns output as string (markdown-formatted)."""
     # The below mimics the function of shell_tool executor
-    import subprocess
-
-    out = None
     try:
-        out = subprocess.run(
-            command, shell=True, capture_output=True, text=True, timeout=30
-        )
+        # Same runner as the tool itself, so both behave alike
+        out = _run_command(command, 30)
         if out.returncode == 0:
             return f"```{language}\n{out.stdout}```"
         else:
@@ -75,45 +244,69 @@ def execute_shell_command(args: Dict[str, Any]) -> str:
     if not command:
         return "Error: No command provided"
 
+    cache_key = (os.getcwd(), command, language)
+    cacheable = SHELL_CACHE_TTL > 0 and is_cacheable_command(command)
+    if cacheable:
+        with _shell_cache_lock:
+            cached = _shell_cache.get(cache_key)
+            generation = _shell_cache_generation
+        if cached and time.monotonic() - cached[0] < SHELL_CACHE_TTL:
+            logger.debug(f"Using cached output for command: {command}")
+            return cached[1]
+    elif SHELL_CACHE_TTL > 0:
+        # Any other command may change what the cached reads would return
+        invalidate_shell_cache()
+
     logger.debug(f"Executing command: {command}")
     try:
         # Execute the command
-        output = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            executable="/bin/bash",
-            timeout=60,  # 1-minute timeout
-        )
+        try:
+            output = _run_command(command, SHELL_TIMEOUT)
+        finally:
+            if SHELL_CACHE_TTL > 0 and not cacheable:
+                # Again after the command, for reads that ran alongside it
+                invalidate_shell_cache()
 
         # Get stdout and stderr
         stdout = output.stdout.strip()
         stderr = output.stderr.strip()
         return_code = output.returncode
 
-        # Format the output
-        formatted_result = ""
+        # Format the output, joining the pieces once instead of growing a
+        # string that can hold megabytes of command output
+        parts = []
 
         # Add stdout if available
         if stdout:
-            formatted_result += f"\n````{language}\n{stdout}\n````\n\n"
+            parts.extend(("\n````", language, "\n", stdout, "\n````\n\n"))
 
         # Add stderr if available and there was an error
         if stderr and return_code != 0:
-            formatted_result += (
-                f"\n**Error (code {return_code}):**\n````text\n{stderr}\n````\n\n"
+            parts.extend(
+                (f"\n**Error (code {return_code}):**\n````text\n", stderr, "\n````\n\n")
             )
 
         # Add a message for empty output
         if not stdout and not stderr:
-            formatted_result += "\n*Command executed with no output*\n"
+            parts.append("\n*Command executed with no output*\n")
+
+        formatted_result = "".join(parts)
+
+        if cacheable and return_code == 0:
+            with _shell_cache_lock:
+                if generation != _shell_cache_generation:
+                    # Invalidated while the command ran, so the output may be stale
+                    return formatted_result
+                if len(_shell_cache) >= _SHELL_CACHE_MAX_ENTRIES:
+                    # Evict the oldest entry
+                    _shell_cache.pop(next(iter(_shell_cache)))
+                _shell_cache[cache_key] = (time.monotonic(), formatted_result)
 
         return formatted_result
 
     except subprocess.TimeoutExpired:
-        logger.error(f"Command timed out after 60 seconds: {command}")
-        return f"Error: Command timed out after 60 seconds: {command}"
+        logger.error(f"Command timed out after {SHELL_TIMEOUT} seconds: {command}")
+        return f"Error: Command timed out after {SHELL_TIMEOUT} seconds: {command}"
     except Exception as e:
         logger.error(f"Error executing command '{command}': {str(e)}")
         return f"Error: {str(e)}"
@@ -11,12 +11,13 @@ For OpenAI and Gemini models, token usage is tracked using metadata from the res
 import logging
 from typing import Any, Dict, Optional, Tuple
 
-from vmpilot.config import Provider, config
-
-logger = logging.getLogger(__name__)
+import litellm
 
+from vmpilot.config import PricingDisplay, Provider, config
 from vmpilot.db.crud import ConversationRepository
 
+logger = logging.getLogger(__name__)
+
 
 class Usage:
     """Track token usage throughout an exchange."""
@@ -134,9 +135,7 @@ class Usage:
         # If we have a model name, use litellm for pricing
         if self.model_name:
             try:
-                from litellm import model_cost
-
-                model_pricing = model_cost.get(self.model_name)
+                model_pricing = litellm.model_cost.get(self.model_name)
                 if model_pricing:
                     logger.debug(
                         f"Using LiteLLM pricing for model {self.model_name}: {model_pricing}"
@@ -279,9 +278,6 @@ class Usage:
         Returns:
             A formatted string with cost breakdown according to pricing_display setting
         """
-        from vmpilot.config import PricingDisplay, config
-        from vmpilot.db.crud import ConversationRepository
-
         pricing_display = config.get_pricing_display()
 
         # If pricing display is disabled, return empty string
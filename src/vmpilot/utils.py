@@ -6,6 +6,33 @@ import json
 from typing import Any
 
 
+def _json_dumps_std(data: Any) -> str:
+    """Serialize data to a JSON string with json, formatted the way orjson does."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+# Use orjson when it is installed (pip install vmpilot[fast]): it is considerably
+# faster than the standard library on the conversation histories stored after
+# every exchange. It is optional, so fall back to json, which gives the same
+# compact output either way.
+try:
+    import orjson
+
+    def json_dumps(data: Any) -> str:
+        """Serialize data to a JSON string."""
+        try:
+            return orjson.dumps(data).decode()
+        except TypeError:
+            # orjson is stricter, e.g. about non-string dict keys
+            return _json_dumps_std(data)
+
+    json_loads = orjson.loads
+
+except ImportError:  # pragma: no cover - depends on the environment
+    json_dumps = _json_dumps_std
+    json_loads = json.loads
+
+
 def extract_text_from_message_content(content: Any) -> str:
     """
     Extract text content from various message content formats.
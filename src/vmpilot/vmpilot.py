@@ -20,29 +20,22 @@ configure_logging()
 # Set up module logger
 logger = logging.getLogger(__name__)
 
-import asyncio
-import queue
-import threading
-import traceback
-from datetime import datetime
-from typing import Dict, Generator, Iterator, List, Optional, Union
+from typing import Generator, Iterator, List, Union
 
 from pydantic import BaseModel
 
 # Now import other modules after logging is configured
-from vmpilot.chat import Chat
+from vmpilot.config import DEFAULT_PROVIDER, Provider, config, parser
 
-# Import tool output truncation setting
-from vmpilot.config import (
-    DEFAULT_PROVIDER,
-    MAX_TOKENS,
-    RECURSION_LIMIT,
-    TEMPERATURE,
-    TOOL_OUTPUT_LINES,
-    Provider,
-    config,
-    parser,
-)
+# Model ids that select a provider rather than a specific model
+_PROVIDER_IDS = frozenset(p.value for p in Provider)
+
+# Valves field holding the API key of each provider
+_API_KEY_FIELDS = {
+    Provider.ANTHROPIC: "anthropic_api_key",
+    Provider.OPENAI: "openai_api_key",
+    Provider.GOOGLE: "google_api_key",
+}
 
 
 class Pipeline:
@@ -129,12 +122,9 @@ class Pipeline:
             """Update API key based on current provider"""
             try:
                 Pipeline._provider = self.provider
-                if self.provider == Provider.ANTHROPIC:
-                    Pipeline._api_key = self.anthropic_api_key
-                elif self.provider == Provider.OPENAI:
-                    Pipeline._api_key = self.openai_api_key
-                elif self.provider == Provider.GOOGLE:
-                    Pipeline._api_key = self.google_api_key
+                key_field = _API_KEY_FIELDS.get(self.provider)
+                if key_field:
+                    Pipeline._api_key = getattr(self, key_field)
                 else:
                     logger.error(f"Unknown provider: {self.provider}")
             except Exception as e:
@@ -228,9 +218,9 @@ class Pipeline:
         self, user_message: str, model_id: str, messages: List[dict], body: dict
     ) -> Union[str, Generator, Iterator]:
         """Execute bash commands through an LLM with tool integration."""
-        logger.debug(f"Full body keys: {list(body.keys())}")
-        logger.debug(f"Messages: {messages}")
-        logger.debug(f"num messages: {len(messages)}")
+        logger.debug("Full body keys: %s", list(body))
+        logger.debug("Messages: %s", messages)
+        logger.debug("num messages: %d", len(messages))
 
         # Disable logging if requested (e.g. when running from CLI)
         if body.get("disable_logging"):
@@ -262,7 +252,7 @@ class Pipeline:
         try:
             # Set provider or model based on model_id
             try:
-                if model_id and model_id.lower() in [p.value for p in Provider]:
+                if model_id and model_id.lower() in _PROVIDER_IDS:
                     self.set_provider(model_id)
                 elif model_id:
                     self.set_model(model_id)
@@ -288,7 +278,7 @@ class Pipeline:
                 # Extract system message
                 if role == "system" and isinstance(content, str):
                     system_prompt_suffix = content
-                    logger.debug(f"System message: {system_prompt_suffix}")
+                    logger.debug("System message: %s", system_prompt_suffix)
                     continue
 
                 if isinstance(content, str):
@@ -306,9 +296,8 @@ class Pipeline:
             """ Set up the params for the process_messages function and run it in a separate thread. """
 
             """
-            In a typical llm chat streaming means that the output is sent to the user as it is generated.
-            In our case, we don't stream the individual tokens in the output, but we do stream the messages as they come.
-            1. The llm's initial response.
+            The output is sent to the user as it is generated:
+            1. The llm's initial response, piece by piece as the tokens arrive.
             2. Tools' output.
             3. The llm's response to the tools' output.
             4. Etc.
@@ -326,15 +315,13 @@ class Pipeline:
                     body, self, messages, system_prompt_suffix, formatted_messages
                 ):
                     output_parts.append(msg)
+                # The parts are consecutive pieces of the output, the LLM text
+                # arrives split into tokens, so join them as they are
                 result = (
-                    "\n\n".join(
-                        str(part).strip() if hasattr(part, "strip") else str(part)
-                        for part in output_parts
-                    )
-                    if output_parts
-                    else "Command executed successfully"
+                    "".join(str(part) for part in output_parts).strip()
+                    or "Command executed successfully"
                 )
-                logger.debug(f"Non-streaming result: {result}")
+                logger.debug("Non-streaming result: %s", result)
                 return result
 
         except Exception as e:  # pragma: no cover
@@ -0,0 +1,693 @@
+"""
+Unit tests for the agent loop in agent.py.
+
+These tests mock the LiteLLM completion call and use simple in-memory tools,
+so no network access or real shell commands are needed.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from litellm.types.utils import (
+    ChatCompletionDeltaToolCall,
+    Delta,
+    Function,
+    ModelResponseStream,
+    StreamingChoices,
+)
+
+from vmpilot.agent import (
+    MAX_PARALLEL_TOOLS,
+    MAX_TOOL_RESULT_CHARS,
+    _index_tools,
+    _is_read_only_tool_call,
+    _log_prompt_cache_hits,
+    _start_streamed_tool_call,
+    _summarize_tool_result,
+    _truncate_history,
+    agent_loop,
+    parse_tool_calls,
+    truncate_tool_output_for_ui,
+)
+from vmpilot.config import MAX_TOKENS, TOOL_OUTPUT_LINES
+from vmpilot.config import Provider as APIProvider
+
+
+def make_tool(name, executor):
+    """Build a tool dictionary in the same shape as setup_tools returns."""
+    return {
+        "schema": {
+            "type": "function",
+            "function": {"name": name, "parameters": {"type": "object"}},
+        },
+        "executor": executor,
+    }
+
+
+def make_response(content=None, tool_calls=None):
+    """Build a minimal LiteLLM-like completion response."""
+    message = SimpleNamespace(
+        role="assistant",
+        content=content,
+        tool_calls=[
+            SimpleNamespace(
+                id=call_id,
+                type="function",
+                function=SimpleNamespace(name=name, arguments=arguments),
+            )
+            for call_id, name, arguments in (tool_calls or [])
+        ],
+    )
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def make_chunk(finish_reason=None, **delta):
+    return ModelResponseStream(
+        model="gpt-4o",
+        choices=[
+            StreamingChoices(index=0, delta=Delta(**delta), finish_reason=finish_reason)
+        ],
+    )
+
+
+async def make_stream(content=None, tool_calls=None):
+    """
+    Stream a response the way LiteLLM does: the content arrives in two pieces,
+    and each tool call's arguments are split across two chunks.
+    """
+    if content:
+        middle = len(content) // 2
+        yield make_chunk(role="assistant", content=content[:middle])
+        yield make_chunk(content=content[middle:])
+    for index, (call_id, name, arguments) in enumerate(tool_calls or []):
+        middle = len(arguments) // 2
+        yield make_chunk(
+            tool_calls=[
+                ChatCompletionDeltaToolCall(
+                    index=index,
+                    id=call_id,
+                    type="function",
+                    function=Function(name=name, arguments=arguments[:middle]),
+                )
+            ]
+        )
+        yield make_chunk(
+            tool_calls=[
+                ChatCompletionDeltaToolCall(
+                    index=index, function=Function(arguments=arguments[middle:])
+                )
+            ]
+        )
+    yield make_chunk(finish_reason="tool_calls" if tool_calls else "stop")
+
+
+async def run_loop(responses, tools, messages):
+    with patch("litellm.acompletion", new=AsyncMock(side_effect=responses)):
+        return [
+            item
+            async for item in agent_loop(
+                tools=tools,
+                model="gpt-4o",
+                messages=messages,
+            )
+        ]
+
+
+class TestParseToolCalls:
+    """Tests for extracting tool calls and content from a response."""
+
+    def test_content_and_tool_calls(self):
+        response = make_response(
+            content="Listing files",
+            tool_calls=[("call_1", "shell", '{"command": "ls"}')],
+        )
+
+        parsed = parse_tool_calls(response)
+
+        assert parsed.content == "Listing files"
+        assert parsed.tool_calls == [
+            {"id": "call_1", "name": "shell", "arguments": {"command": "ls"}}
+        ]
+        assert parsed.history_tool_calls == [
+            {
+                "id": "call_1",
+                "type": "function",
+                "function": {"name": "shell", "arguments": '{"command": "ls"}'},
+            }
+        ]
+
+    def test_malformed_arguments(self):
+        response = make_response(tool_calls=[("call_1", "shell", "{not json")])
+
+        parsed = parse_tool_calls(response)
+
+        assert parsed.content is None
+        assert parsed.tool_calls[0]["arguments"] == {
+            "error": "Failed to parse arguments"
+        }
+        # The history keeps what the model actually sent
+        assert parsed.history_tool_calls[0]["function"]["arguments"] == "{not json"
+
+    def test_arguments_must_be_an_object(self):
+        response = make_response(tool_calls=[("call_1", "shell", '["ls"]')])
+
+        tool_calls = parse_tool_calls(response).tool_calls
+
+        assert tool_calls[0]["arguments"] == {"error": "Failed to parse arguments"}
+
+    @pytest.mark.parametrize(
+        "arguments, expected",
+        [
+            ("", {}),
+            ('{}{"command": "ls"}', {"command": "ls"}),
+            ('"{\\"command\\": \\"ls\\"}"', {"command": "ls"}),
+            (
+                '{"command": "ls", "options": {"all": true',
+                {"command": "ls", "options": {"all": True}},
+            ),
+            ('Arguments: {"command": "ls"}', {"command": "ls"}),
+        ],
+    )
+    def test_repairs_malformed_arguments(self, arguments, expected):
+        response = make_response(tool_calls=[("call_1", "shell", arguments)])
+
+        tool_calls = parse_tool_calls(response).tool_calls
+
+        assert tool_calls[0]["arguments"] == expected
+
+    def test_repair_warning_logs_only_a_preview(self, caplog):
+        body = "x" * 10000
+        arguments = '{"path": "f.py", "content": "%s"' % body
+        response = make_response(tool_calls=[("call_1", "edit_file", arguments)])
+
+        with caplog.at_level(logging.WARNING, logger="vmpilot.agent"):
+            parse_tool_calls(response)
+
+        (record,) = caplog.records
+        assert f"({len(arguments)} chars)" in record.getMessage()
+        assert len(record.getMessage()) < 300
+
+    def test_response_without_choices(self):
+        assert parse_tool_calls(SimpleNamespace(choices=[])) == ([], None, None, [])
+
+    def test_finish_reason(self):
+        response = make_response(content="done")
+        response.choices[0].finish_reason = "stop"
+
+        assert parse_tool_calls(response).finish_reason == "stop"
+
+
+class TestTruncateToolOutput:
+    """Tests for shortening tool output shown in the UI."""
+
+    @pytest.mark.parametrize(
+        "output, expected",
+        [
+            ("short", "short\n"),
+            ("short\n", "short\n"),
+            # A single extra line is shown rather than announced
+            ("x\n" * (TOOL_OUTPUT_LINES + 1), "x\n" * (TOOL_OUTPUT_LINES + 1)),
+            (
+                "x\n" * (TOOL_OUTPUT_LINES + 5),
+                "\n".join(["x"] * TOOL_OUTPUT_LINES)
+                + "\n...\n````\n(and 5 more lines)\n",
+            ),
+        ],
+    )
+    def test_keeps_the_first_lines(self, output, expected):
+        assert truncate_tool_output_for_ui(output) == expected
+
+
+class TestToolExecution:
+    """Tests for executing the tool calls of one assistant turn."""
+
+    @pytest.mark.asyncio
+    async def test_tool_calls_run_concurrently_and_keep_order(self):
+        """Tool calls from one turn overlap in time but results stay in order."""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def slow_echo(args):
+            # Both calls must be running at the same time to pass the barrier
+            barrier.wait()
+            if args["text"] == "first":
+                time.sleep(0.05)
+            return args["text"]
+
+        tools = [make_tool("web_search", slow_echo)]
+        messages = [{"role": "user", "content": "do it"}]
+        responses = [
+            make_stream(
+                tool_calls=[
+                    ("call_1", "web_search", '{"text": "first"}'),
+                    ("call_2", "web_search", '{"text": "second"}'),
+                ]
+            ),
+            make_stream(content="done"),
+        ]
+
+        outputs = await run_loop(responses, tools, messages)
+
+        tool_messages = [m for m in messages if m["role"] == "tool"]
+        assert [m["tool_call_id"] for m in tool_messages] == ["call_1", "call_2"]
+        assert [m["content"] for m in tool_messages] == ["first", "second"]
+        assert outputs[:2] == ["first\n", "second\n"]
+        assert "".join(outputs[2:]) == "done"
+
+    @pytest.mark.asyncio
+    async def test_parallel_tool_calls_are_bounded(self):
+        """No more than MAX_PARALLEL_TOOLS tool calls run at the same time."""
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def track(args):
+            with lock:
+                running.append(args["n"])
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(args["n"])
+            return str(args["n"])
+
+        tools = [make_tool("web_search", track)]
+        messages = [{"role": "user", "content": "do it"}]
+        calls = [(f"call_{n}", "web_search", f'{{"n": {n}}}') for n in range(10)]
+        responses = [make_stream(tool_calls=calls), make_stream(content="done")]
+
+        await run_loop(responses, tools, messages)
+
+        assert max(peak) <= MAX_PARALLEL_TOOLS
+        tool_messages = [m for m in messages if m["role"] == "tool"]
+        assert [m["content"] for m in tool_messages] == [str(n) for n in range(10)]
+
+    @pytest.mark.asyncio
+    async def test_other_tool_calls_run_one_at_a_time_in_order(self):
+        """Edits and commands that may change state never overlap other calls."""
+        lock = threading.Lock()
+        running = []
+        events = []
+
+        def track(args):
+            with lock:
+                events.append(("start", args["n"], list(running)))
+                running.append(args["n"])
+            time.sleep(0.02)
+            with lock:
+                running.remove(args["n"])
+            return str(args["n"])
+
+        tools = [make_tool("edit_file", track), make_tool("web_search", track)]
+        messages = [{"role": "user", "content": "do it"}]
+        calls = [
+            ("call_1", "edit_file", '{"n": 1}'),
+            ("call_2", "edit_file", '{"n": 2}'),
+            ("call_3", "web_search", '{"n": 3}'),
+            ("call_4", "web_search", '{"n": 4}'),
+            ("call_5", "edit_file", '{"n": 5}'),
+        ]
+        responses = [make_stream(tool_calls=calls), make_stream(content="done")]
+
+        await run_loop(responses, tools, messages)
+
+        starts = {n: running_then for _, n, running_then in events}
+        assert [n for _, n, _ in events][:2] == [1, 2]
+        assert events[-1][1] == 5
+        assert starts[1] == starts[2] == starts[5] == []
+        assert set(starts[3] + starts[4]) <= {3, 4}
+
+    @pytest.mark.parametrize(
+        "name, arguments, expected",
+        [
+            ("shell", {"command": "git status"}, True),
+            ("shell", {"command": "cat a > b"}, False),
+            ("shell", {"command": "python run.py"}, False),
+            ("web_search", {"query": "x"}, True),
+            ("edit_file", {"path": "a"}, False),
+            ("create_file", {"path": "a"}, False),
+        ],
+    )
+    def test_read_only_tool_calls(self, name, arguments, expected):
+        tool_call = {"id": "call_1", "name": name, "arguments": arguments}
+        assert _is_read_only_tool_call(tool_call) is expected
+
+    @pytest.mark.asyncio
+    async def test_unknown_tool_reports_error(self):
+        """A tool call for an unknown tool is answered with an error result."""
+        tools = [make_tool("echo", lambda args: args["text"])]
+        messages = [{"role": "user", "content": "do it"}]
+        responses = [
+            make_stream(tool_calls=[("call_1", "missing", "{}")]),
+            make_stream(content="done"),
+        ]
+
+        await run_loop(responses, tools, messages)
+
+        tool_message = next(m for m in messages if m["role"] == "tool")
+        assert "Tool 'missing' not found" in tool_message["content"]
+        assert "echo" in tool_message["content"]
+
+    @pytest.mark.asyncio
+    async def test_long_tool_result_is_capped(self):
+        """A huge tool result keeps its start and end in the history."""
+        long_output = "start" + "x" * (2 * MAX_TOOL_RESULT_CHARS) + "end"
+        tools = [make_tool("dump", lambda args: long_output)]
+        messages = [{"role": "user", "content": "do it"}]
+        responses = [
+            make_stream(tool_calls=[("call_1", "dump", "{}")]),
+            make_stream(content="done"),
+        ]
+
+        await run_loop(responses, tools, messages)
+
+        result = next(m for m in messages if m["role"] == "tool")["content"]
+        assert result.startswith("start") and result.endswith("end")
+        assert "characters truncated" in result
+        assert len(result) < MAX_TOOL_RESULT_CHARS + 200
+
+    def test_tools_are_indexed_by_name(self):
+        first = make_tool("echo", lambda args: "first")
+        old_format = {"schema": {"name": "search"}, "executor": lambda args: ""}
+        tools = [first, make_tool("echo", lambda args: "second"), old_format]
+
+        assert _index_tools(tools) == {"echo": first, "search": old_format}
+
+    @pytest.mark.asyncio
+    async def test_large_tool_result_is_summarized_when_enabled(self):
+        long_output = "line\n" * 2000
+        tools = [make_tool("dump", lambda args: long_output)]
+        messages = [{"role": "user", "content": "find the error"}]
+        responses = [
+            make_stream(tool_calls=[("call_1", "dump", "{}")]),
+            make_response(content="no errors"),
+            make_stream(content="done"),
+        ]
+
+        with patch("vmpilot.agent.TOOL_RESULT_SUMMARY_MODEL", "gpt-4o-mini"):
+            outputs = await run_loop(responses, tools, messages)
+
+        result = next(m for m in messages if m["role"] == "tool")["content"]
+        assert result.endswith("no errors")
+        assert str(len(long_output)) in result
+        # The UI still gets the output itself
+        assert any(output.startswith("line\n") for output in outputs)
+
+    @pytest.mark.asyncio
+    async def test_summary_uses_the_main_api_key(self):
+        tools = [make_tool("dump", lambda args: "line\n" * 2000)]
+        messages = [{"role": "user", "content": "find the error"}]
+        responses = [
+            make_stream(tool_calls=[("call_1", "dump", "{}")]),
+            make_response(content="no errors"),
+            make_stream(content="done"),
+        ]
+        acompletion = AsyncMock(side_effect=responses)
+
+        with (
+            patch("vmpilot.agent.TOOL_RESULT_SUMMARY_MODEL", "gpt-4o-mini"),
+            patch("litellm.acompletion", new=acompletion),
+        ):
+            async for _ in agent_loop(
+                tools=tools,
+                model="gpt-4o",
+                messages=messages,
+                agent_config={"api_key": "key-from-file"},
+            ):
+                pass
+
+        summary_call = acompletion.call_args_list[1]
+        assert summary_call.kwargs["model"] == "gpt-4o-mini"
+        assert summary_call.kwargs["api_key"] == "key-from-file"
+
+    @pytest.mark.asyncio
+    async def test_failed_summary_keeps_the_result(self):
+        with patch("litellm.acompletion", new=AsyncMock(side_effect=Exception("down"))):
+            assert await _summarize_tool_result("output", "task") == "output"
+
+
+class TestCompletionParams:
+    """Tests for the parameters sent to LiteLLM."""
+
+    @pytest.mark.asyncio
+    async def test_openai_requests_use_chat_prompt_cache_key(self):
+        """OpenAI requests carry a per-chat prompt_cache_key."""
+        exchange = MagicMock(chat_id="chat123")
+        agent_config = {
+            "model": "gpt-4o",
+            "api_key": "test-key",
+            "provider": APIProvider.OPENAI,
+        }
+        completion = AsyncMock(return_value=make_stream(content="done"))
+
+        with patch("litellm.acompletion", new=completion):
+            async for _ in agent_loop(
+                tools=[],
+                messages=[{"role": "user", "content": "hi"}],
+                exchange=exchange,
+                agent_config=agent_config,
+            ):
+                pass
+
+        kwargs = completion.call_args.kwargs
+        assert kwargs["extra_body"] == {"prompt_cache_key": "chat123"}
+        assert kwargs["stream_options"] == {"include_usage": True}
+
+    @pytest.mark.asyncio
+    async def test_followup_requests_use_followup_max_tokens(self):
+        """Only the requests after tool results get the lower output limit."""
+        tools = [make_tool("echo", lambda args: "ok")]
+        messages = [{"role": "user", "content": "do it"}]
+        completion = AsyncMock(
+            side_effect=[
+                make_stream(tool_calls=[("call_1", "echo", "{}")]),
+                make_stream(content="done"),
+            ]
+        )
+
+        with (
+            patch("vmpilot.agent.FOLLOWUP_MAX_TOKENS", 256),
+            patch("litellm.acompletion", new=completion),
+        ):
+            async for _ in agent_loop(tools=tools, messages=messages):
+                pass
+
+        first, followup = completion.call_args_list
+        assert first.kwargs["max_tokens"] == MAX_TOKENS
+        assert followup.kwargs["max_tokens"] == 256
+
+
+class TestStreaming:
+    """Tests for streaming the LLM response."""
+
+    @pytest.mark.asyncio
+    async def test_content_is_yielded_as_it_arrives(self):
+        messages = [{"role": "user", "content": "hi"}]
+
+        with patch("vmpilot.agent._STREAM_FLUSH_CHARS", 1):
+            outputs = await run_loop([make_stream(content="Hello world")], [], messages)
+
+        assert outputs == ["Hello", " world"]
+        assert messages[-1] == {"role": "assistant", "content": "Hello world"}
+
+    @pytest.mark.asyncio
+    async def test_small_deltas_are_coalesced(self):
+        messages = [{"role": "user", "content": "hi"}]
+
+        with patch("vmpilot.agent._STREAM_FLUSH_SECONDS", 60):
+            outputs = await run_loop([make_stream(content="Hello world")], [], messages)
+
+        assert outputs == ["Hello world"]
+
+    @pytest.mark.asyncio
+    async def test_streaming_can_be_turned_off(self):
+        messages = [{"role": "user", "content": "hi"}]
+
+        with patch("vmpilot.agent.STREAM_RESPONSES", False):
+            outputs = await run_loop(
+                [
+                    make_response(tool_calls=[("call_1", "echo", '{"text": "x"}')]),
+                    make_response(content="Hello world"),
+                ],
+                [make_tool("echo", lambda args: args["text"])],
+                messages,
+            )
+
+        assert outputs == ["x\n", "Hello world"]
+        assert messages[-1] == {"role": "assistant", "content": "Hello world"}
+
+    @pytest.mark.asyncio
+    async def test_tool_call_starts_before_the_response_ends(self):
+        """A tool call runs as soon as the next one starts streaming."""
+        first_ran = threading.Event()
+        seen_before_end = []
+
+        def record(args):
+            if args["text"] == "first":
+                first_ran.set()
+            return args["text"]
+
+        def tool_call_chunk(index, call_id=None, name=None, arguments=""):
+            return make_chunk(
+                tool_calls=[
+                    ChatCompletionDeltaToolCall(
+                        index=index,
+                        id=call_id,
+                        type="function",
+                        function=Function(name=name, arguments=arguments),
+                    )
+                ]
+            )
+
+        async def stream():
+            yield tool_call_chunk(0, "call_1", "record", '{"text": "first"}')
+            yield tool_call_chunk(1, "call_2", "record", '{"text": ')
+            # The first call runs while the second one is still streaming
+            seen_before_end.append(await asyncio.to_thread(first_ran.wait, 5))
+            yield tool_call_chunk(1, arguments='"second"}')
+            yield make_chunk(finish_reason="tool_calls")
+
+        messages = [{"role": "user", "content": "do it"}]
+        responses = [stream(), make_stream(content="done")]
+
+        await run_loop(responses, [make_tool("record", record)], messages)
+
+        assert seen_before_end == [True]
+        tool_messages = [m for m in messages if m["role"] == "tool"]
+        assert [m["content"] for m in tool_messages] == ["first", "second"]
+
+    @pytest.mark.asyncio
+    async def test_started_tool_call_is_cancelled_when_the_stream_fails(self):
+        """A tool call started while streaming doesn't outlive a failed response."""
+        release = threading.Event()
+        started_tasks = []
+
+        def record_start(streamed_call, tools_by_name, semaphore, *state):
+            started = _start_streamed_tool_call(
+                streamed_call, tools_by_name, semaphore, *state
+            )
+            started_tasks.extend(state[-1].values())
+            return started
+
+        def tool_call_chunk(index, call_id, arguments):
+            return make_chunk(
+                tool_calls=[
+                    ChatCompletionDeltaToolCall(
+                        index=index,
+                        id=call_id,
+                        type="function",
+                        function=Function(name="wait", arguments=arguments),
+                    )
+                ]
+            )
+
+        async def stream():
+            yield tool_call_chunk(0, "call_1", "{}")
+            yield tool_call_chunk(1, "call_2", "{")
+            raise ConnectionError("stream dropped")
+
+        messages = [{"role": "user", "content": "do it"}]
+        tools = [make_tool("wait", lambda args: release.wait(5))]
+        try:
+            with patch("vmpilot.agent._start_streamed_tool_call", record_start):
+                outputs = await run_loop([stream()], tools, messages)
+        finally:
+            release.set()
+
+        assert outputs == ["Error: stream dropped"]
+        assert len(started_tasks) == 1
+        await asyncio.wait(started_tasks, timeout=5)
+        assert started_tasks[0].cancelled()
+
+    @pytest.mark.asyncio
+    async def test_tool_call_arguments_are_reassembled(self):
+        received = []
+
+        def echo(args):
+            received.append(args)
+            return args["text"]
+
+        messages = [{"role": "user", "content": "do it"}]
+        responses = [
+            make_stream(tool_calls=[("call_1", "echo", '{"text": "streamed"}')]),
+            make_stream(content="done"),
+        ]
+
+        await run_loop(responses, [make_tool("echo", echo)], messages)
+
+        assert received == [{"text": "streamed"}]
+        assert messages[1]["tool_calls"][0]["function"] == {
+            "name": "echo",
+            "arguments": '{"text": "streamed"}',
+        }
+
+    def test_logs_prompt_cache_hit_rate(self, caplog):
+        usage_data = SimpleNamespace(
+            prompt_tokens=1000,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=900),
+        )
+
+        with caplog.at_level("DEBUG", logger="vmpilot.agent"):
+            _log_prompt_cache_hits(usage_data, 2)
+
+        assert "900 of 1000 prompt tokens cached (90%)" in caplog.text
+
+
+def count_messages(model, messages):
+    """Stand-in token counter: every message costs 10 tokens."""
+    return 10 * len(messages)
+
+
+class TestTruncateHistory:
+    """Tests for keeping the history within the token budget."""
+
+    def make_history(self):
+        return [
+            {"role": "system", "content": "system"},
+            {"role": "user", "content": "first"},
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{"id": "call_1", "type": "function"}],
+            },
+            {"role": "tool", "tool_call_id": "call_1", "content": "output"},
+            {"role": "assistant", "content": "done"},
+            {"role": "user", "content": "second"},
+            {"role": "assistant", "content": "answer"},
+            {"role": "user", "content": "third"},
+        ]
+
+    def test_history_within_budget_is_unchanged(self):
+        history = self.make_history()
+        with patch("litellm.token_counter", count_messages):
+            assert _truncate_history(history, "gpt-4o", 80) is history
+
+    def test_drops_oldest_exchange_with_its_tool_results(self):
+        with patch("litellm.token_counter", count_messages):
+            result = _truncate_history(self.make_history(), "gpt-4o", 50)
+
+        assert [msg["content"] for msg in result] == [
+            "system",
+            "second",
+            "answer",
+            "third",
+        ]
+
+    def test_messages_are_counted_once_across_calls(self):
+        history = self.make_history()
+        token_counts = {}
+        with patch("litellm.token_counter", side_effect=count_messages) as counter:
+            _truncate_history(history, "gpt-4o", 50, token_counts)
+            history.append({"role": "assistant", "content": "more"})
+            _truncate_history(history, "gpt-4o", 50, token_counts)
+
+        assert counter.call_count == len(history)
+
+    def test_keeps_system_and_current_exchange_over_budget(self):
+        with patch("litellm.token_counter", count_messages):
+            result = _truncate_history(self.make_history(), "gpt-4o", 1)
+
+        assert [msg["content"] for msg in result] == ["system", "third"]
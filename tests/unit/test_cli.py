@@ -0,0 +1,22 @@
+"""
+Unit tests for printing streamed output in the CLI.
+"""
+
+from vmpilot.cli import print_complete_lines
+
+
+def test_complete_lines_are_printed_and_the_rest_is_kept(capsys):
+    pending = print_complete_lines("first line\nsecond", [])
+    assert pending == "second"
+    pending = print_complete_lines(pending + " line\n", [])
+    assert pending == ""
+
+    assert capsys.readouterr().out == "first line\nsecond line\n"
+
+
+def test_lines_matching_skip_patterns_are_left_out(capsys):
+    skip_patterns = ["ls -la", "Executing command"]
+
+    print_complete_lines("ls -la\nExecuting command: ls\nfile.txt\n", skip_patterns)
+
+    assert capsys.readouterr().out == "file.txt\n"
@@ -8,6 +8,7 @@ from vmpilot.config import (
     ConfigError,
     ModelConfig,
     Provider,
+    _read_api_key_file,
     find_config_file,
     load_config,
 )
@@ -159,3 +160,15 @@ api_key_env = OPENAI_API_KEY
     finally:
         # Clean up environment
         del os.environ["VMPILOT_CONFIG"]
+
+
+def test_api_key_file_is_read_once(tmp_path):
+    """API key files are cached, so each request doesn't read the disk"""
+    key_file = tmp_path / "test.key"
+    key_file.write_text("first-key\n")
+    try:
+        assert _read_api_key_file(str(key_file)) == "first-key"
+        key_file.write_text("second-key\n")
+        assert _read_api_key_file(str(key_file)) == "first-key"
+    finally:
+        _read_api_key_file.cache_clear()
@@ -184,6 +184,22 @@ class TestConversationRepository(unittest.TestCase):
         # Verify that retrieved cache info matches updated cache info
         self.assertEqual(retrieved_cache_info, new_cache_info)
 
+    def test_save_with_merged_cache_info(self):
+        """Test that saving keeps stored cache info keys not being set."""
+        chat_id = "test-chat-123"
+        self.repo.save_conversation_state(
+            chat_id, self.messages, {"input_tokens": 10, "output_tokens": 20}
+        )
+
+        saved = self.repo.save_with_merged_cache_info(
+            chat_id, self.messages[:2], {"input_tokens": 30}
+        )
+
+        messages, cache_info = self.repo.get_conversation_state(chat_id)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(cache_info, {"input_tokens": 30, "output_tokens": 20})
+        self.assertEqual(saved, cache_info)
+
     def test_get_nonexistent_conversation(self):
         """Test retrieving a conversation that doesn't exist."""
         chat_id = "nonexistent-chat"
@@ -91,6 +91,16 @@ class TestDatabaseConnectionManagement(unittest.TestCase):
             "Error closing database connection", self.mock_logger.error.call_args[0][0]
         )
 
+    @patch("vmpilot.db.connection._db_connection", None)
+    def test_get_db_connection_uses_write_ahead_log(self):
+        """Test that new connections switch the database to WAL mode."""
+        connection = get_db_connection()
+        try:
+            journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal_mode, "wal")
+        finally:
+            connection.close()
+
     @patch("vmpilot.db.connection.config")
     def test_get_db_path_with_config(self, mock_config):
         """Test getting the database path from configuration."""
@@ -0,0 +1,68 @@
+"""
+Unit tests for the Anthropic cache control added by modify_state_messages.
+"""
+
+import copy
+
+import pytest
+
+from vmpilot.config import Provider as APIProvider
+from vmpilot.config import current_provider
+from vmpilot.init_agent import modify_state_messages
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+@pytest.fixture
+def anthropic():
+    token = current_provider.set(APIProvider.ANTHROPIC)
+    yield
+    current_provider.reset(token)
+
+
+def make_history():
+    return [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "first", "cache_control": EPHEMERAL},
+        {"role": "assistant", "content": "answer"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image", "source": "..."},
+                {"type": "text", "text": "look"},
+                {"type": "text", "text": "again"},
+            ],
+        },
+        {"role": "tool", "content": "output", "tool_call_id": "call_1"},
+    ]
+
+
+def test_marks_the_last_three_messages(anthropic):
+    modified = modify_state_messages(make_history())
+
+    assert "cache_control" not in modified[0]
+    # Stale cache control on older messages is dropped
+    assert "cache_control" not in modified[1]
+    assert modified[2]["cache_control"] == EPHEMERAL
+    # Only the first text block of a list is marked
+    blocks = modified[3]["content"]
+    assert [block.get("cache_control") for block in blocks] == [None, EPHEMERAL, None]
+    assert modified[4]["cache_control"] == EPHEMERAL
+
+
+def test_leaves_the_history_unchanged(anthropic):
+    history = make_history()
+    original = copy.deepcopy(history)
+
+    modify_state_messages(history)
+
+    assert history == original
+
+
+def test_other_providers_are_untouched():
+    token = current_provider.set(APIProvider.OPENAI)
+    try:
+        history = make_history()
+        assert modify_state_messages(history) is history
+    finally:
+        current_provider.reset(token)
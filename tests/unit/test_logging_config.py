@@ -0,0 +1,45 @@
+"""
+Unit tests for the root logger filter in logging_config.
+"""
+
+import logging
+
+import pytest
+
+from vmpilot.logging_config import StreamContentFilter, configure_logging
+
+
+def make_record(name, msg, args=None):
+    return logging.LogRecord(name, logging.INFO, __file__, 1, msg, args, None)
+
+
+@pytest.mark.parametrize(
+    "msg, args, kept",
+    [
+        ("stream_content:Generator: abc", None, False),
+        ("stream:true:<generator object x>", None, False),
+        ("stream:true:%s", ("<generator object x>",), False),
+        ("regular message %s", ("value",), True),
+        ("regular message", None, True),
+    ],
+)
+def test_root_stream_messages_are_filtered(msg, args, kept):
+    record = make_record("root", msg, args)
+    assert StreamContentFilter().filter(record) is kept
+
+
+def test_other_loggers_are_not_filtered():
+    record = make_record("vmpilot.agent", "stream_content:Generator: abc")
+    assert StreamContentFilter().filter(record) is True
+
+
+def test_configure_logging_adds_the_filter_once():
+    root_logger = logging.getLogger()
+    original_filters = list(root_logger.filters)
+    try:
+        configure_logging()
+        configure_logging()
+        filters = [f for f in root_logger.filters if isinstance(f, StreamContentFilter)]
+        assert len(filters) == 1
+    finally:
+        root_logger.filters = original_filters
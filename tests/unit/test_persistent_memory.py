@@ -50,29 +50,23 @@ class TestPersistentMemory(unittest.TestCase):
 
     def test_save_conversation_state(self):
         """Test that save_conversation_state calls the repository correctly."""
-        # Configure mock to return empty state
-        self.mock_repo.get_conversation_state.return_value = ([], {})
-
         # Call the function under test
         save_conversation_state(self.thread_id, self.messages, self.cache_info)
 
-        # Verify that the repository was called correctly
-        self.mock_repo.save_conversation_state.assert_called_once_with(
+        # The merge happens in the repository, without loading the history
+        self.mock_repo.save_with_merged_cache_info.assert_called_once_with(
             self.thread_id, self.messages, self.cache_info
         )
+        self.mock_repo.get_conversation_state.assert_not_called()
 
     def test_save_conversation_state_with_no_cache_info(self):
         """Test save_conversation_state with no cache_info parameter."""
-        # Configure mock to return existing cache info
-        existing_cache_info = {"input_tokens": 5, "output_tokens": 15}
-        self.mock_repo.get_conversation_state.return_value = ([], existing_cache_info)
-
         # Call the function under test without cache_info
         save_conversation_state(self.thread_id, self.messages)
 
-        # Verify that the repository was called with existing cache info
-        self.mock_repo.save_conversation_state.assert_called_once_with(
-            self.thread_id, self.messages, existing_cache_info
+        # Verify that the repository is left to keep the existing cache info
+        self.mock_repo.save_with_merged_cache_info.assert_called_once_with(
+            self.thread_id, self.messages, None
         )
 
     def test_get_conversation_state(self):
@@ -0,0 +1,91 @@
+"""
+Unit tests for response.py, the bridge between the pipeline and the agent.
+"""
+
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from vmpilot.response import generate_responses
+
+
+def make_pipeline():
+    """Build the minimal pipeline object generate_responses reads from."""
+    return SimpleNamespace(
+        valves=SimpleNamespace(
+            model="gpt-4o", provider=SimpleNamespace(value="openai")
+        ),
+        _api_key="test-key",
+    )
+
+
+def run(formatted_messages):
+    return generate_responses(
+        body={},
+        pipeline_self=make_pipeline(),
+        messages=formatted_messages,
+        system_prompt_suffix="",
+        formatted_messages=formatted_messages,
+    )
+
+
+class TestGenerateResponses:
+    """Tests for streaming agent output through generate_responses."""
+
+    def test_yields_agent_output_in_order(self):
+        async def fake_process_messages(output_callback, **kwargs):
+            output_callback({"type": "text", "text": "one"})
+            output_callback({"type": "text", "text": "two"})
+
+        messages = [{"role": "user", "content": "hi"}]
+        with patch("vmpilot.response.process_messages", fake_process_messages):
+            assert list(run(messages)) == ["one", "two"]
+
+    def test_no_user_input(self):
+        messages = [{"role": "system", "content": "system"}]
+        assert list(run(messages)) == ["Error: No user input found"]
+
+    def test_closing_the_generator_cancels_the_agent(self):
+        cancelled = threading.Event()
+
+        async def fake_process_messages(output_callback, **kwargs):
+            output_callback({"type": "text", "text": "started"})
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        messages = [{"role": "user", "content": "hi"}]
+        with patch("vmpilot.response.process_messages", fake_process_messages):
+            responses = run(messages)
+            assert next(responses) == "started"
+            responses.close()
+
+        assert cancelled.wait(timeout=5)
+
+    def test_tool_output_is_truncated(self):
+        async def fake_process_messages(tool_output_callback, **kwargs):
+            tool_output_callback({"output": "line\n" * 100}, None)
+
+        messages = [{"role": "user", "content": "hi"}]
+        with patch("vmpilot.response.process_messages", fake_process_messages):
+            (output,) = run(messages)
+
+        assert output.startswith("line\n")
+        assert "more lines" in output
+
+    def test_event_loop_is_reused_across_requests(self):
+        loops = []
+
+        async def fake_process_messages(output_callback, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            output_callback("ok")
+
+        messages = [{"role": "user", "content": "hi"}]
+        with patch("vmpilot.response.process_messages", fake_process_messages):
+            for _ in range(3):
+                assert list(run(messages)) == ["ok"]
+
+        assert all(not loop.is_closed() for loop in loops)
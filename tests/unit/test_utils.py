@@ -8,7 +8,13 @@ import json
 import unittest
 from unittest.mock import patch
 
-from vmpilot.utils import extract_text_from_message_content, serialize_for_storage
+from vmpilot.utils import (
+    _json_dumps_std,
+    extract_text_from_message_content,
+    json_dumps,
+    json_loads,
+    serialize_for_storage,
+)
 
 
 class TestUtils(unittest.TestCase):
@@ -118,6 +124,21 @@ class TestUtils(unittest.TestCase):
             result = serialize_for_storage(data)
             self.assertEqual(result, str(data))
 
+    def test_json_round_trip(self):
+        """Test that json_dumps and json_loads round-trip a message list."""
+        messages = [{"role": "user", "content": "héllo", "tool_calls": []}]
+        self.assertEqual(json_loads(json_dumps(messages)), messages)
+
+    def test_json_dumps_accepts_what_json_does(self):
+        """Test that json_dumps handles data only the standard library accepts."""
+        self.assertEqual(json.loads(json_dumps({1: "one"})), {"1": "one"})
+
+    def test_json_dumps_matches_the_standard_library_fallback(self):
+        """Test that json_dumps gives the same text with or without orjson."""
+        data = {"z": 1, "a": [{"content": "héllo ✓", "ok": True, "none": None}]}
+        self.assertIsInstance(json_dumps(data), str)
+        self.assertEqual(json_dumps(data), _json_dumps_std(data))
+
 
 if __name__ == "__main__":
     unittest.main()
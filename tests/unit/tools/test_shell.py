@@ -1,5 +1,9 @@
+import subprocess
+import time
+
 import pytest
 
+from vmpilot.tools import shelltool
 from vmpilot.tools.shelltool import ShellTool
 
 
@@ -44,3 +48,127 @@ class TestShellTool:
             }
         )
         assert "test_file.txt" in result
+
+
+class TestShellTimeout:
+    def test_timeout_kills_background_jobs(self, monkeypatch):
+        """A background job holding the output pipe doesn't outlive the timeout."""
+        monkeypatch.setattr(shelltool, "SHELL_TIMEOUT", 0.5)
+        start = time.monotonic()
+
+        result = shelltool.execute_shell_command({"command": "sleep 30 & sleep 30"})
+
+        assert "timed out after 0.5 seconds" in result
+        assert time.monotonic() - start < 10
+
+    def test_child_outside_the_group_does_not_hold_up_the_result(self):
+        """A setsid child keeping the output pipe open is left behind."""
+        start = time.monotonic()
+
+        result = shelltool._run_command("setsid sleep 5 & echo done", 0.5)
+
+        assert time.monotonic() - start < 0.5 + shelltool._PIPE_GRACE_SECONDS + 1
+        assert result.returncode == 0
+        assert result.stdout == "done\n"
+
+    def test_timeout_keeps_the_output_of_a_child_outside_the_group(self):
+        """A timed out command with a setsid child still returns in time."""
+        start = time.monotonic()
+
+        with pytest.raises(subprocess.TimeoutExpired) as excinfo:
+            shelltool._run_command("echo started; setsid sleep 5 & sleep 30", 0.5)
+
+        assert time.monotonic() - start < 0.5 + shelltool._PIPE_GRACE_SECONDS + 1
+        assert excinfo.value.output == "started\n"
+
+
+class TestShellOutput:
+    def test_invalid_utf8_is_replaced(self):
+        """Binary output is shown with replacement characters instead of failing."""
+        result = shelltool.execute_shell_command({"command": r"printf 'ok \377\n'"})
+
+        assert "ok \ufffd" in result
+
+    def test_large_output_keeps_start_and_end(self, monkeypatch):
+        """Output past the limit is dropped from the middle, not the ends."""
+        monkeypatch.setattr(shelltool, "SHELL_OUTPUT_LIMIT", 3000)
+        monkeypatch.setattr(shelltool, "_PIPE_READ_SIZE", 100)
+
+        result = shelltool._run_command("seq 1 100000; echo done", 5)
+
+        assert result.returncode == 0
+        assert result.stdout.startswith("1\n2\n3\n")
+        assert result.stdout.endswith("99999\n100000\ndone\n")
+        assert "bytes of output omitted" in result.stdout
+        assert len(result.stdout) < 3100
+
+    def test_commands_run_in_bash_mode(self):
+        """Commands run in bash proper, not in its POSIX (sh) mode."""
+        result = shelltool._run_command("shopt -oq posix && echo sh || echo bash", 5)
+
+        assert result.stdout == "bash\n"
+
+
+class TestShellCache:
+    """Tests for reusing the output of read-only commands."""
+
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, monkeypatch):
+        monkeypatch.setattr(shelltool, "SHELL_CACHE_TTL", 30)
+        shelltool.invalidate_shell_cache()
+        yield
+        shelltool.invalidate_shell_cache()
+
+    def test_read_only_command_is_cached(self, tmp_path):
+        """A repeated read-only command returns the cached output."""
+        target = tmp_path / "file.txt"
+        target.write_text("first")
+        command = f"cat {target}"
+
+        assert "first" in shelltool.execute_shell_command({"command": command})
+        target.write_text("second")
+        assert "first" in shelltool.execute_shell_command({"command": command})
+
+    def test_other_command_invalidates_cache(self, tmp_path):
+        """Running a command that may change state clears the cache."""
+        target = tmp_path / "file.txt"
+        target.write_text("first")
+        command = f"cat {target}"
+
+        shelltool.execute_shell_command({"command": command})
+        shelltool.execute_shell_command({"command": f"echo second > {target}"})
+        assert "second" in shelltool.execute_shell_command({"command": command})
+
+    def test_cache_is_per_working_directory(self, tmp_path, monkeypatch):
+        """The same command in another project directory is run again."""
+        for name in ("one", "two"):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / f"{name}.txt").write_text(name)
+
+        monkeypatch.chdir(tmp_path / "one")
+        assert "one.txt" in shelltool.execute_shell_command({"command": "ls"})
+        monkeypatch.chdir(tmp_path / "two")
+        assert "two.txt" in shelltool.execute_shell_command({"command": "ls"})
+
+    def test_output_is_not_stored_after_an_invalidation(self, monkeypatch):
+        """A read that overlapped a change doesn't cache its output."""
+        run_command = shelltool._run_command
+
+        def run_during_change(command, timeout):
+            result = run_command(command, timeout)
+            shelltool.invalidate_shell_cache()
+            return result
+
+        monkeypatch.setattr(shelltool, "_run_command", run_during_change)
+        shelltool.execute_shell_command({"command": "pwd"})
+
+        assert shelltool._shell_cache == {}
+
+    def test_cacheable_commands(self):
+        """Only plain read-only commands are cacheable."""
+        assert shelltool.is_cacheable_command("ls -la /tmp")
+        assert shelltool.is_cacheable_command("git status")
+        assert not shelltool.is_cacheable_command("rm -rf /tmp/x")
+        assert not shelltool.is_cacheable_command("cat a; rm b")
+        assert not shelltool.is_cacheable_command("cat a > b")
+        assert not shelltool.is_cacheable_command("ls $(rm b)")